@@ -1,21 +1,32 @@
+import io
 import psycopg2
 import psycopg2.extras
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2.pool import ThreadedConnectionPool
 from typing import List, Optional, Dict
 from decimal import Decimal
-from .matching_engine import BlueLineItem, NegativeInvoice, MatchResult
+from .matching_engine import BlueLineItem, NegativeInvoice, MatchResult, MatchAllocation, FailureReasons
 from .performance_monitor import get_performance_timer
 from config.config import DYNAMIC_LIMIT_BASE, DYNAMIC_LIMIT_MAX
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 暂存表导入：达到该行数时用 COPY，否则用多行 INSERT
+COPY_MIN_ROWS = 100
+
 class DatabaseManager:
     """数据库管理器，负责所有数据库操作"""
     
     def __init__(self, db_config: dict, pool_size: int = 20):
-        """初始化数据库连接池"""
-        self.pool = SimpleConnectionPool(
+        """
+        初始化数据库连接池
+
+        Args:
+            db_config: 数据库配置
+            pool_size: 连接池最大连接数
+        """
+        # 线程安全的连接池：允许多个线程共享同一个管理器
+        self.pool = ThreadedConnectionPool(
             2, pool_size,  # 最小连接数从1增加到2
             host=db_config['host'],
             port=db_config['port'],
@@ -75,7 +86,7 @@ class DatabaseManager:
                 result = [
                     BlueLineItem(
                         line_id=row[0],
-                        remaining=Decimal(str(row[1])),
+                        remaining=row[1],  # NUMERIC 列由 psycopg2 直接返回 Decimal
                         tax_rate=row[2],
                         buyer_id=row[3],
                         seller_id=row[4]
@@ -102,7 +113,8 @@ class DatabaseManager:
     def get_candidates_batch(self,
                            conditions: List[tuple],
                            limit: int = 10000,
-                           group_counts: Dict[tuple, int] = None) -> Dict[tuple, List[BlueLineItem]]:
+                           group_counts: Dict[tuple, int] = None,
+                           group_amounts: Dict[tuple, Decimal] = None) -> Dict[tuple, List[BlueLineItem]]:
         """
         批量获取候选蓝票行，减少数据库往返次数
 
@@ -110,6 +122,8 @@ class DatabaseManager:
             conditions: [(tax_rate, buyer_id, seller_id), ...] 条件列表
             limit: 默认每个条件的限制数量
             group_counts: {条件: 该组负数发票数量} 用于动态计算limit
+            group_amounts: {条件: 该组负数发票总金额}，提供时只返回贪婪分配可能用到的前缀：
+                按 remaining 升序，之前的可用余额累计尚未达到总金额的行
 
         Returns:
             Dict[tuple, List[BlueLineItem]]: 条件到候选列表的映射
@@ -129,9 +143,9 @@ class DatabaseManager:
                 'limit': limit
             }):
                 with conn.cursor() as cur:
-                    # 使用UNION ALL + 动态LIMIT优化查询性能
-                    union_queries = []
-
+                    # 所有条件作为数组参数一次传入，LATERAL 子查询按组取前 N 条（动态LIMIT）
+                    # 语句文本与条件数量无关，替代拼接 N 个 UNION ALL 子查询
+                    tax_rates, buyer_ids, seller_ids, limits, targets = [], [], [], [], []
                     for condition in conditions:
                         tax_rate, buyer_id, seller_id = condition
 
@@ -143,20 +157,46 @@ class DatabaseManager:
                             # 兼容模式：使用默认limit
                             actual_limit = limit
 
-                        union_queries.append(f"""
-                            (SELECT line_id, remaining, tax_rate, buyer_id, seller_id
-                             FROM blue_lines
-                             WHERE tax_rate = {tax_rate}
-                               AND buyer_id = {buyer_id}
-                               AND seller_id = {seller_id}
-                               AND remaining > 0
-                             ORDER BY remaining ASC
-                             LIMIT {actual_limit})
-                        """)
-
-                    # 合并所有子查询
-                    query = " UNION ALL ".join(union_queries)
-                    cur.execute(query)
+                        tax_rates.append(tax_rate)
+                        buyer_ids.append(buyer_id)
+                        seller_ids.append(seller_id)
+                        limits.append(actual_limit)
+                        # 无总金额时为 NULL，不做前缀截断
+                        targets.append(group_amounts.get(condition) if group_amounts else None)
+
+                    # prior_sum：按 remaining 升序排在该行之前、可被匹配使用（> 0.01）的余额累计。
+                    # 贪婪算法总是从最小余额开始消耗，组内总消耗不超过组总金额，
+                    # 因此 prior_sum 已达到总金额之后的行不会被用到，无需传回客户端。
+                    # 窗口之下先按索引顺序取前 lim 行，索引扫描读满即停，窗口只在这 lim 行上计算
+                    cur.execute("""
+                        SELECT b.line_id, b.remaining, b.tax_rate, b.buyer_id, b.seller_id
+                        FROM unnest(%s::int[], %s::int[], %s::int[], %s::int[], %s::numeric[])
+                             WITH ORDINALITY AS k(tax_rate, buyer_id, seller_id, lim, target, ord)
+                        CROSS JOIN LATERAL (
+                            SELECT line_id, remaining, tax_rate, buyer_id, seller_id
+                            FROM (
+                                SELECT line_id, remaining, tax_rate, buyer_id, seller_id,
+                                       COALESCE(SUM(remaining) FILTER (WHERE remaining > 0.01) OVER (
+                                           ORDER BY remaining, line_id
+                                           ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                                       ), 0) AS prior_sum
+                                FROM (
+                                    SELECT line_id, remaining, tax_rate, buyer_id, seller_id
+                                    FROM blue_lines
+                                    WHERE tax_rate = k.tax_rate
+                                      AND buyer_id = k.buyer_id
+                                      AND seller_id = k.seller_id
+                                      AND remaining > 0
+                                    ORDER BY remaining, line_id
+                                    LIMIT k.lim
+                                ) top
+                            ) c
+                            WHERE k.target IS NULL OR c.prior_sum < k.target
+                            ORDER BY remaining ASC, line_id
+                            LIMIT k.lim
+                        ) b
+                        ORDER BY k.ord, b.remaining ASC
+                    """, (tax_rates, buyer_ids, seller_ids, limits, targets))
                     all_rows = cur.fetchall()
 
             with timer.measure("data_conversion", {
@@ -170,7 +210,7 @@ class DatabaseManager:
                     if condition in result and len(result[condition]) < limit:
                         result[condition].append(BlueLineItem(
                             line_id=row[0],
-                            remaining=Decimal(str(row[1])),
+                            remaining=row[1],  # NUMERIC 列由 psycopg2 直接返回 Decimal
                             tax_rate=row[2],
                             buyer_id=row[3],
                             seller_id=row[4]
@@ -234,53 +274,43 @@ class DatabaseManager:
                 'records_count': len(match_records)
             }):
                 with conn.cursor() as cur:
-                    # 使用PostgreSQL FROM VALUES语法批量更新蓝票行
-                    logger.debug(f"批量更新 {len(all_allocations)} 条蓝票行")
-
-                    # 构建参数列表用于executemany
-                    update_params = []
+                    # 同一蓝票行可能被组内多张负数发票使用，先按行汇总扣减金额
+                    # （UPDATE ... FROM VALUES 中同一目标行只会被更新一次）
+                    line_deltas: Dict[int, Decimal] = {}
                     for line_id, amount_used in all_allocations:
-                        update_params.append((amount_used, line_id, amount_used))
+                        line_deltas[line_id] = line_deltas.get(line_id, Decimal('0')) + amount_used
 
-                    # 使用executemany进行批量更新（保持原子性但更可靠）
-                    cur.executemany("""
-                        UPDATE blue_lines
-                        SET remaining = remaining - %s,
+                    # 使用PostgreSQL FROM VALUES语法批量更新蓝票行（每页一条语句）
+                    logger.debug(f"批量更新 {len(line_deltas)} 条蓝票行")
+                    updated_rows = psycopg2.extras.execute_values(cur, """
+                        UPDATE blue_lines AS b
+                        SET remaining = b.remaining - v.delta,
                             last_update = CURRENT_TIMESTAMP
-                        WHERE line_id = %s
-                          AND remaining >= %s
-                    """, update_params)
+                        FROM (VALUES %s) AS v(line_id, delta)
+                        WHERE b.line_id = v.line_id
+                          AND b.remaining >= v.delta
+                        RETURNING b.line_id
+                    """, list(line_deltas.items()), template="(%s::bigint, %s::numeric)",
+                        page_size=1000, fetch=True)
 
-                    updated_count = cur.rowcount
+                    updated_count = len(updated_rows)
 
                     # 检查是否所有行都成功更新（防止并发冲突）
-                    if updated_count != len(all_allocations):
-                        # 查询哪些行的余额不足
-                        line_ids = [str(line_id) for line_id, _ in all_allocations]
-                        cur.execute(f"""
-                            SELECT line_id, remaining
-                            FROM blue_lines
-                            WHERE line_id IN ({','.join(line_ids)})
-                        """)
-
-                        actual_remaining = {row[0]: row[1] for row in cur.fetchall()}
-                        failed_lines = []
-
-                        for line_id, amount_used in all_allocations:
-                            if line_id not in actual_remaining or actual_remaining[line_id] < amount_used:
-                                failed_lines.append(line_id)
+                    if updated_count != len(line_deltas):
+                        updated_ids = {row[0] for row in updated_rows}
+                        failed_lines = [line_id for line_id in line_deltas if line_id not in updated_ids]
 
                         raise Exception(f"并发冲突: {len(failed_lines)} 条记录更新失败, "
                                       f"失败行: {failed_lines}")
 
-                    # 批量插入匹配记录
+                    # 批量插入匹配记录（多行 VALUES）
                     if match_records:
                         logger.debug(f"批量插入 {len(match_records)} 条匹配记录")
-                        cur.executemany("""
+                        psycopg2.extras.execute_values(cur, """
                             INSERT INTO match_records
                             (batch_id, negative_invoice_id, blue_line_id, amount_used)
-                            VALUES (%s, %s, %s, %s)
-                        """, match_records)
+                            VALUES %s
+                        """, match_records, page_size=1000)
 
             with timer.measure("database_transaction_commit"):
                 conn.commit()
@@ -307,6 +337,209 @@ class DatabaseManager:
                     except:
                         pass
     
+    def match_batch_sql(self,
+                        negatives: List[NegativeInvoice],
+                        batch_id: str,
+                        fragment_threshold: Decimal = Decimal('5.0'),
+                        commit: bool = True) -> List[MatchResult]:
+        """
+        在数据库内以集合方式完成贪婪匹配（对照 GreedyMatchingEngine 的Python实现）
+
+        每个 (tax_rate, buyer_id, seller_id) 组内：负数发票按金额降序排列、蓝票行按 remaining 升序排列。
+        递归CTE按顺序逐张推进已占用的累计供给：剩余供给足够的发票占用区间 [consumed, consumed + amount)，
+        不足的发票判为失败且不推进累计值，与Python引擎跳过失败发票的行为一致。
+        每张成功发票的需求区间与蓝票行累计供给区间的重叠部分即分配金额。
+        与 match_single 相同：只使用 remaining > 0.01 的蓝票行，允许1分钱误差（缺口不超过0.01仍判成功，需求区间截断到总供给）。
+        差异：部分使用后剩余不超过0.01的蓝票行，Python引擎在后续发票中不再使用，这里仍计入供给（整数金额数据下不会出现）。
+        更新 blue_lines 与写入 match_records 在同一条语句、同一事务内完成。
+
+        注意：供给查询未加行锁，仅用于测试环境对比。
+
+        Args:
+            commit: 为 False 时匹配完成后回滚事务，只返回结果，不修改余额也不写入匹配记录
+
+        Returns:
+            List[MatchResult]: 与 negatives 顺序一致的匹配结果
+        """
+        if not negatives:
+            return []
+
+        timer = get_performance_timer()
+
+        with timer.measure("database_connection_acquire"):
+            conn = self.pool.getconn()
+
+        try:
+            with timer.measure("database_sql_matching", {
+                'negatives_count': len(negatives)
+            }):
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        CREATE TEMP TABLE tmp_negatives (
+                            invoice_id BIGINT,
+                            amount DECIMAL(15,2),
+                            tax_rate SMALLINT,
+                            buyer_id INTEGER,
+                            seller_id INTEGER
+                        ) ON COMMIT DROP
+                    """)
+                    rows = [(n.invoice_id, n.amount, n.tax_rate, n.buyer_id, n.seller_id) for n in negatives]
+                    if len(rows) >= COPY_MIN_ROWS:
+                        # 行数较多时用 COPY 导入暂存表，类型检查等开销按整批摊销
+                        buf = io.StringIO()
+                        for row in rows:
+                            buf.write('\t'.join(map(str, row)))
+                            buf.write('\n')
+                        buf.seek(0)
+                        cur.copy_expert(
+                            "COPY tmp_negatives (invoice_id, amount, tax_rate, buyer_id, seller_id) "
+                            "FROM STDIN WITH (FORMAT text)",
+                            buf
+                        )
+                    else:
+                        psycopg2.extras.execute_values(
+                            cur, "INSERT INTO tmp_negatives VALUES %s", rows, page_size=1000
+                        )
+                    # 组内序号单独落表并建索引，递归CTE每一步按 (组, 序号) 取下一张发票
+                    cur.execute("""
+                        CREATE TEMP TABLE tmp_demand ON COMMIT DROP AS
+                        SELECT invoice_id, amount, tax_rate, buyer_id, seller_id,
+                               ROW_NUMBER() OVER (PARTITION BY tax_rate, buyer_id, seller_id
+                                                  ORDER BY amount DESC, invoice_id) AS rn
+                        FROM tmp_negatives;
+                        CREATE INDEX ON tmp_demand (tax_rate, buyer_id, seller_id, rn);
+                        ANALYZE tmp_demand
+                    """)
+                    cur.execute("""
+                        WITH RECURSIVE supply AS (
+                            SELECT b.line_id, b.tax_rate, b.buyer_id, b.seller_id,
+                                   SUM(b.remaining) OVER w - b.remaining AS s_start,
+                                   SUM(b.remaining) OVER w AS s_end,
+                                   SUM(b.remaining) OVER (PARTITION BY b.tax_rate, b.buyer_id, b.seller_id) AS s_total
+                            FROM blue_lines b
+                            JOIN (SELECT DISTINCT tax_rate, buyer_id, seller_id FROM tmp_negatives) k
+                              ON b.tax_rate = k.tax_rate
+                             AND b.buyer_id = k.buyer_id
+                             AND b.seller_id = k.seller_id
+                            WHERE b.remaining > 0.01
+                            WINDOW w AS (PARTITION BY b.tax_rate, b.buyer_id, b.seller_id
+                                         ORDER BY b.remaining, b.line_id)
+                        ),
+                        totals AS (
+                            SELECT DISTINCT tax_rate, buyer_id, seller_id, s_total FROM supply
+                        ),
+                        walk AS (
+                            -- consumed：此前成功发票已占用的累计供给（失败的发票不推进）
+                            SELECT d.tax_rate, d.buyer_id, d.seller_id, d.rn, d.invoice_id,
+                                   d.amount::numeric AS amount,
+                                   0::numeric AS consumed,
+                                   t.s_total::numeric AS s_total
+                            FROM tmp_demand d
+                            JOIN totals t
+                              ON t.tax_rate = d.tax_rate
+                             AND t.buyer_id = d.buyer_id
+                             AND t.seller_id = d.seller_id
+                            WHERE d.rn = 1
+                            UNION ALL
+                            SELECT d.tax_rate, d.buyer_id, d.seller_id, d.rn, d.invoice_id,
+                                   d.amount::numeric,
+                                   CASE WHEN w.consumed + w.amount <= w.s_total + 0.01
+                                        THEN LEAST(w.consumed + w.amount, w.s_total)
+                                        ELSE w.consumed END,
+                                   w.s_total
+                            FROM walk w
+                            JOIN tmp_demand d
+                              ON d.tax_rate = w.tax_rate
+                             AND d.buyer_id = w.buyer_id
+                             AND d.seller_id = w.seller_id
+                             AND d.rn = w.rn + 1
+                        ),
+                        demand AS (
+                            SELECT invoice_id, tax_rate, buyer_id, seller_id,
+                                   consumed AS d_start,
+                                   LEAST(consumed + amount, s_total) AS d_end
+                            FROM walk
+                            WHERE consumed + amount <= s_total + 0.01
+                        ),
+                        alloc AS (
+                            SELECT d.invoice_id, s.line_id,
+                                   LEAST(d.d_end, s.s_end) - GREATEST(d.d_start, s.s_start) AS amount_used,
+                                   s.s_end - LEAST(d.d_end, s.s_end) AS remaining_after
+                            FROM demand d
+                            JOIN supply s
+                              ON s.tax_rate = d.tax_rate
+                             AND s.buyer_id = d.buyer_id
+                             AND s.seller_id = d.seller_id
+                            WHERE s.s_start < d.d_end
+                              AND d.d_start < s.s_end
+                        ),
+                        upd AS (
+                            UPDATE blue_lines b
+                            SET remaining = b.remaining - a.used,
+                                last_update = CURRENT_TIMESTAMP
+                            FROM (SELECT line_id, SUM(amount_used) AS used FROM alloc GROUP BY line_id) a
+                            WHERE b.line_id = a.line_id
+                        ),
+                        ins AS (
+                            INSERT INTO match_records (batch_id, negative_invoice_id, blue_line_id, amount_used)
+                            SELECT %s, invoice_id, line_id, amount_used FROM alloc
+                        )
+                        SELECT invoice_id, line_id, amount_used, remaining_after
+                        FROM alloc
+                        ORDER BY invoice_id, amount_used
+                    """, (batch_id,))
+                    rows = cur.fetchall()
+
+            if commit:
+                with timer.measure("database_transaction_commit"):
+                    conn.commit()
+            else:
+                with timer.measure("database_transaction_rollback"):
+                    conn.rollback()
+
+        except Exception as e:
+            with timer.measure("database_transaction_rollback"):
+                conn.rollback()
+            logger.error(f"SQL匹配失败: {e}")
+            raise
+        finally:
+            with timer.measure("database_connection_release"):
+                try:
+                    if conn and not conn.closed:
+                        self.pool.putconn(conn)
+                except Exception as e:
+                    logger.error(f"连接释放错误: {e}")
+                    try:
+                        if conn and not conn.closed:
+                            conn.close()
+                    except:
+                        pass
+
+        with timer.measure("data_conversion", {'rows_count': len(rows)}):
+            allocations_by_invoice: Dict[int, List[MatchAllocation]] = {}
+            for invoice_id, line_id, amount_used, remaining_after in rows:
+                allocations_by_invoice.setdefault(invoice_id, []).append(MatchAllocation(
+                    blue_line_id=line_id,
+                    amount_used=amount_used,
+                    remaining_after=remaining_after
+                ))
+
+            results = []
+            for negative in negatives:
+                allocations = allocations_by_invoice.get(negative.invoice_id, [])
+                results.append(MatchResult(
+                    negative_invoice_id=negative.invoice_id,
+                    success=bool(allocations),
+                    allocations=allocations,
+                    total_matched=sum((a.amount_used for a in allocations), Decimal('0')),
+                    fragments_created=sum(
+                        1 for a in allocations if Decimal('0') < a.remaining_after < fragment_threshold
+                    ),
+                    failure_reason=None if allocations else FailureReasons.INSUFFICIENT_TOTAL_AMOUNT
+                ))
+
+        return results
+
     def get_statistics(self) -> Dict:
         """获取统计信息"""
         conn = self.pool.getconn()
@@ -351,7 +584,22 @@ class CandidateProvider:
 
     def __init__(self, db_manager: DatabaseManager):
         self.db_manager = db_manager
+        # 按 (tax_rate, buyer_id, seller_id) 缓存已排序的候选列表，每次批量匹配开始时清空
+        self._cache: Dict[tuple, List[BlueLineItem]] = {}
 
     def get_candidates(self, tax_rate: int, buyer_id: int, seller_id: int):
-        """获取候选蓝票行"""
-        return self.db_manager.get_candidates(tax_rate, buyer_id, seller_id)
\ No newline at end of file
+        """
+        获取候选蓝票行（同一条件只查询一次数据库）
+
+        返回的是缓存中的共享列表，调用方不得修改列表或其中的元素（匹配引擎组内匹配会先深拷贝）
+        """
+        key = (tax_rate, buyer_id, seller_id)
+        candidates = self._cache.get(key)
+        if candidates is None:
+            candidates = self.db_manager.get_candidates(tax_rate, buyer_id, seller_id)
+            self._cache[key] = candidates
+        return candidates
+
+    def clear_cache(self):
+        """清空候选缓存（数据库中的余额可能已变化时调用）"""
+        self._cache.clear()
\ No newline at end of file
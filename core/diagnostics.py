@@ -76,13 +76,33 @@ class MatchDiagnostics:
         Returns:
             DiagnosisResult: 诊断结果
         """
+        return self._diagnose(negative, self._get_candidates_for_diagnosis(negative))
+
+    def diagnose_no_match_batch(self, negatives: List[NegativeInvoice]) -> List[DiagnosisResult]:
+        """
+        批量诊断多个匹配失败的负数发票，所有候选集通过一次查询取回
+
+        Args:
+            negatives: 负数发票列表
+
+        Returns:
+            List[DiagnosisResult]: 与 negatives 顺序一致的诊断结果
+        """
+        candidates_by_condition = self._get_candidates_for_diagnosis_batch(negatives)
+        return [
+            self._diagnose(negative, candidates_by_condition.get(
+                (negative.tax_rate, negative.buyer_id, negative.seller_id), []))
+            for negative in negatives
+        ]
+
+    def _diagnose(self, negative: NegativeInvoice, candidates: List[BlueLineItem]) -> DiagnosisResult:
+        """基于已取回的候选集完成诊断分析"""
         logger.info(f"开始诊断负数发票 {negative.invoice_id} 的匹配失败原因")
 
         # 1. 基础条件检查
         basic_issues = self._check_basic_conditions(negative)
 
-        # 2. 查找候选集
-        candidates = self._get_candidates_for_diagnosis(negative)
+        # 2. 候选集由调用方查询后传入
 
         # 3. 分析资金可用性
         fund_analysis = self._analyze_fund_availability(negative, candidates)
@@ -158,7 +178,7 @@ class MatchDiagnostics:
                 return [
                     BlueLineItem(
                         line_id=row[0],
-                        remaining=Decimal(str(row[1])),
+                        remaining=row[1],  # NUMERIC 列由 psycopg2 直接返回 Decimal
                         tax_rate=row[2],
                         buyer_id=row[3],
                         seller_id=row[4]
@@ -168,6 +188,44 @@ class MatchDiagnostics:
         finally:
             self.db_manager.pool.putconn(conn)
 
+    def _get_candidates_for_diagnosis_batch(self, negatives: List[NegativeInvoice]) -> Dict[tuple, List[BlueLineItem]]:
+        """批量获取诊断候选集：去重后的条件作为数组参数一次传入，LATERAL 子查询按组各取前1000条"""
+        conditions = list(dict.fromkeys((n.tax_rate, n.buyer_id, n.seller_id) for n in negatives))
+        if not conditions:
+            return {}
+
+        conn = self.db_manager.pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                tax_rates, buyer_ids, seller_ids = (list(col) for col in zip(*conditions))
+                cur.execute("""
+                    SELECT b.line_id, b.remaining, b.tax_rate, b.buyer_id, b.seller_id
+                    FROM unnest(%s::int[], %s::int[], %s::int[])
+                         WITH ORDINALITY AS k(tax_rate, buyer_id, seller_id, ord)
+                    CROSS JOIN LATERAL (
+                        SELECT line_id, remaining, tax_rate, buyer_id, seller_id
+                        FROM blue_lines
+                        WHERE tax_rate = k.tax_rate AND buyer_id = k.buyer_id AND seller_id = k.seller_id
+                          AND remaining > 0
+                        ORDER BY remaining ASC
+                        LIMIT 1000
+                    ) b
+                    ORDER BY k.ord, b.remaining ASC
+                """, (tax_rates, buyer_ids, seller_ids))
+
+                result = {condition: [] for condition in conditions}
+                for row in cur.fetchall():
+                    result[(row[2], row[3], row[4])].append(BlueLineItem(
+                        line_id=row[0],
+                        remaining=row[1],
+                        tax_rate=row[2],
+                        buyer_id=row[3],
+                        seller_id=row[4]
+                    ))
+                return result
+        finally:
+            self.db_manager.pool.putconn(conn)
+
     def _analyze_fund_availability(self, negative: NegativeInvoice,
                                  candidates: List[BlueLineItem]) -> Dict:
         """分析资金可用性"""
@@ -538,7 +596,7 @@ class MatchDiagnostics:
                 return [
                     BlueLineItem(
                         line_id=row[0],
-                        remaining=Decimal(str(row[1])),
+                        remaining=row[1],  # NUMERIC 列由 psycopg2 直接返回 Decimal
                         tax_rate=row[2],
                         buyer_id=row[3],
                         seller_id=row[4]
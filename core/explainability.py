@@ -11,6 +11,8 @@ from decimal import Decimal
 import json
 from datetime import datetime
 from collections import defaultdict, Counter
+import heapq
+import itertools
 import logging
 
 from .matching_engine import MatchResult, NegativeInvoice, MatchFailureDetail, FailureReasons
@@ -33,6 +35,79 @@ class BatchAnalysisReport:
     generated_at: str                          # 生成时间
 
 
+class BatchAnalysisAccumulator:
+    """
+    增量式批量分析统计
+
+    逐批 add() 匹配结果，只累加计数与金额，不保留原始结果列表；
+    另保留金额最高的 top_k 个失败案例（结果+负数发票）供深度诊断抽样
+    """
+
+    def __init__(self, top_k: int = 50):
+        self.top_k = top_k
+        self.total_processed = 0
+        self.success_count = 0
+        self.failure_patterns: Counter = Counter()
+        self.total_failed_amount = 0.0
+        self.high_value_failures = 0
+        self.failure_by_amount_range = defaultdict(int)
+        self.failed_amount_count = 0
+        self._top_failures: List[Tuple[float, int, MatchResult, NegativeInvoice]] = []  # 最小堆
+        self._seq = itertools.count()
+
+    def add(self, results: List[MatchResult], negatives: Optional[List[NegativeInvoice]] = None):
+        """累加一批匹配结果（negatives 为该批对应的负数发票，用于业务影响统计）"""
+        self.total_processed += len(results)
+        negative_map = {n.invoice_id: n for n in negatives} if negatives else {}
+
+        for result in results:
+            if result.success:
+                self.success_count += 1
+                continue
+
+            self.failure_patterns[result.failure_reason or "unknown"] += 1
+
+            negative = negative_map.get(result.negative_invoice_id)
+            if negative is None:
+                continue
+            amount = float(negative.amount)
+            self.failed_amount_count += 1
+            self.total_failed_amount += amount
+
+            # 高价值失败统计（>10000元）
+            if amount > 10000:
+                self.high_value_failures += 1
+
+            # 按金额范围统计
+            if amount < 100:
+                self.failure_by_amount_range["small"] += 1
+            elif amount < 1000:
+                self.failure_by_amount_range["medium"] += 1
+            else:
+                self.failure_by_amount_range["large"] += 1
+
+            entry = (amount, next(self._seq), result, negative)
+            if len(self._top_failures) < self.top_k:
+                heapq.heappush(self._top_failures, entry)
+            elif self._top_failures and amount > self._top_failures[0][0]:
+                heapq.heapreplace(self._top_failures, entry)
+
+    def top_failures(self, n: Optional[int] = None) -> List[Tuple[MatchResult, NegativeInvoice]]:
+        """金额从高到低返回保留的失败案例"""
+        ranked = heapq.nlargest(n or self.top_k, self._top_failures, key=lambda e: (e[0], -e[1]))
+        return [(result, negative) for _, _, result, negative in ranked]
+
+    def business_impact(self) -> Dict:
+        """业务影响汇总"""
+        return {
+            "total_failed_amount": self.total_failed_amount,
+            "high_value_failures": self.high_value_failures,
+            "failure_by_amount_range": self.failure_by_amount_range,
+            "avg_failure_amount": (self.total_failed_amount / self.failed_amount_count
+                                   if self.failed_amount_count else 0.0)
+        }
+
+
 class ExplainabilityReporter:
     """可解释性报告生成器"""
 
@@ -205,85 +280,32 @@ class ExplainabilityReporter:
         Returns:
             BatchAnalysisReport: 批量分析报告
         """
-        total_processed = len(results)
-        success_count = sum(1 for r in results if r.success)
+        accumulator = BatchAnalysisAccumulator(top_k=0)
+        accumulator.add(results, negatives)
+        return self.build_batch_analysis(accumulator)
+
+    def build_batch_analysis(self, accumulator: BatchAnalysisAccumulator) -> BatchAnalysisReport:
+        """基于增量统计生成批量分析报告（适合逐批累加、不保留全部结果的长时间运行）"""
+        total_processed = accumulator.total_processed
+        success_count = accumulator.success_count
         failure_count = total_processed - success_count
         success_rate = success_count / total_processed if total_processed > 0 else 0
 
-        # 统计失败模式
-        failure_patterns = defaultdict(int)
-        failure_reasons = []
-
-        for result in results:
-            if not result.success:
-                reason = result.failure_reason or "unknown"
-                failure_patterns[reason] += 1
-                failure_reasons.append(reason)
-
-        # 获取主要失败原因
-        reason_counter = Counter(failure_reasons)
-        top_failure_reasons = reason_counter.most_common(5)
-
-        # 业务影响分析
-        business_impact = self._analyze_business_impact(results, negatives)
-
-        # 生成改进建议
-        recommendations = self._generate_improvement_suggestions(failure_patterns, business_impact)
+        failure_patterns = dict(accumulator.failure_patterns)
+        business_impact = accumulator.business_impact()
 
         return BatchAnalysisReport(
             total_processed=total_processed,
             success_count=success_count,
             failure_count=failure_count,
             success_rate=success_rate,
-            failure_patterns=dict(failure_patterns),
-            top_failure_reasons=top_failure_reasons,
+            failure_patterns=failure_patterns,
+            top_failure_reasons=accumulator.failure_patterns.most_common(5),
             business_impact_summary=business_impact,
-            recommendations=recommendations,
+            recommendations=self._generate_improvement_suggestions(failure_patterns, business_impact),
             generated_at=datetime.now().isoformat()
         )
 
-    def _analyze_business_impact(self, results: List[MatchResult],
-                               negatives: Optional[List[NegativeInvoice]]) -> Dict:
-        """分析业务影响"""
-        impact = {
-            "total_failed_amount": 0.0,
-            "high_value_failures": 0,
-            "failure_by_amount_range": defaultdict(int),
-            "avg_failure_amount": 0.0
-        }
-
-        if not negatives:
-            return impact
-
-        # 创建ID到负数发票的映射
-        negative_map = {n.invoice_id: n for n in negatives}
-
-        failed_amounts = []
-        for result in results:
-            if not result.success and result.negative_invoice_id in negative_map:
-                negative = negative_map[result.negative_invoice_id]
-                amount = float(negative.amount)
-                failed_amounts.append(amount)
-
-                impact["total_failed_amount"] += amount
-
-                # 高价值失败统计（>10000元）
-                if amount > 10000:
-                    impact["high_value_failures"] += 1
-
-                # 按金额范围统计
-                if amount < 100:
-                    impact["failure_by_amount_range"]["small"] += 1
-                elif amount < 1000:
-                    impact["failure_by_amount_range"]["medium"] += 1
-                else:
-                    impact["failure_by_amount_range"]["large"] += 1
-
-        if failed_amounts:
-            impact["avg_failure_amount"] = sum(failed_amounts) / len(failed_amounts)
-
-        return impact
-
     def _generate_improvement_suggestions(self, failure_patterns: Dict[str, int],
                                         business_impact: Dict) -> List[str]:
         """基于失败统计生成改进建议"""
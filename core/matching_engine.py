@@ -4,6 +4,7 @@ from decimal import Decimal
 import logging
 import time
 import copy
+import numpy as np
 from config.config import DYNAMIC_LIMIT_BASE, DYNAMIC_LIMIT_MAX
 
 logger = logging.getLogger(__name__)
@@ -20,6 +21,18 @@ class FailureReasons:
     CONCURRENT_CONFLICT = "concurrent_conflict"
     AMOUNT_TOO_SMALL = "amount_too_small"
 
+# 匹配结果汇总用的结构数组类型：金额以分（int64）存储
+RESULT_DTYPE = np.dtype([('success', '?'), ('matched', 'i8'), ('fragments', 'i4')])
+
+
+def results_to_ndarray(results: List['MatchResult']) -> np.ndarray:
+    """将匹配结果列表转换为结构数组，便于用 NumPy 一次性汇总"""
+    return np.fromiter(
+        ((r.success, int(r.total_matched.scaleb(2)), r.fragments_created) for r in results),
+        dtype=RESULT_DTYPE, count=len(results)
+    )
+
+
 @dataclass
 class BlueLineItem:
     """蓝票行数据模型"""
@@ -29,6 +42,11 @@ class BlueLineItem:
     buyer_id: int
     seller_id: int
 
+    @property
+    def remaining_cents(self) -> int:
+        """余额（分，int），供整数分匹配内核使用"""
+        return int(self.remaining.scaleb(2))
+
 @dataclass
 class NegativeInvoice:
     """负数发票数据模型"""
@@ -39,6 +57,11 @@ class NegativeInvoice:
     seller_id: int
     priority: int = 0  # 优先级，用于排序
 
+    @property
+    def cents(self) -> int:
+        """金额（分，int），供整数分匹配内核使用"""
+        return int(self.amount.scaleb(2))
+
 @dataclass
 class MatchAllocation:
     """匹配分配结果"""
@@ -472,7 +495,15 @@ class GreedyMatchingEngine:
 
                 logger.info(f"动态limit统计: 总计{total_limit}, 平均{avg_limit:.1f}, 每个负数发票平均{avg_candidates_per_negative:.1f}个候选")
 
-            group_candidates = candidate_provider.db_manager.get_candidates_batch(conditions, group_counts=group_counts)
+            # 每组总金额：数据库只返回贪婪分配可能用到的候选前缀
+            group_amounts = {
+                condition: sum((negative.amount for _, negative in group_negatives), Decimal('0'))
+                for condition, group_negatives in groups.items()
+            }
+
+            group_candidates = candidate_provider.db_manager.get_candidates_batch(
+                conditions, group_counts=group_counts, group_amounts=group_amounts
+            )
 
             # 确保所有组都有候选列表（即使为空）
             for group_key in groups.keys():
@@ -514,16 +545,17 @@ class GreedyMatchingEngine:
         # 创建候选集的深拷贝以实时更新remaining
         local_candidates = {c.line_id: copy.deepcopy(c) for c in candidates}
 
+        # 按remaining升序只排序一次（贪婪算法要求）。贪婪分配只会用完排在最前面的若干行，
+        # 并部分扣减最后使用的一行，扣减后它仍不大于后面未使用的行，因此顺序始终保持有序
+        ordered_candidates = sorted(local_candidates.values(), key=lambda x: x.remaining)
+
         for original_index, negative in sorted_group:
-            # 过滤remaining为0的蓝票行，并转换为列表
+            # 过滤remaining为0的蓝票行（保持升序）
             available_candidates = [
-                c for c in local_candidates.values()
+                c for c in ordered_candidates
                 if c.remaining > Decimal('0.01')
             ]
 
-            # 按remaining升序排序（贪婪算法要求）
-            available_candidates.sort(key=lambda x: x.remaining)
-
             # 执行匹配
             result = self.match_single(negative, available_candidates)
             results[original_index] = result
@@ -533,6 +565,7 @@ class GreedyMatchingEngine:
                 for alloc in result.allocations:
                     if alloc.blue_line_id in local_candidates:
                         local_candidates[alloc.blue_line_id].remaining = alloc.remaining_after
+                ordered_candidates = available_candidates
 
             logger.debug(f"匹配负数发票 {negative.invoice_id}: "
                        f"{'成功' if result.success else '失败'}, "
@@ -660,6 +693,10 @@ class GreedyMatchingEngine:
         """
         batch_count = len(negatives)
 
+        # 候选缓存只在一次批量匹配内有效，避免读到上一批次保存前的余额
+        if hasattr(candidate_provider, 'clear_cache'):
+            candidate_provider.clear_cache()
+
         # 智能路由：自动选择最优处理方式
         if batch_count >= 10000:
             # 大批量：使用流式处理
@@ -720,13 +757,14 @@ class GreedyMatchingEngine:
     def calculate_metrics(self, results: List[MatchResult]) -> Dict:
         """计算匹配指标"""
         total = len(results)
-        success = sum(1 for r in results if r.success)
+        arr = results_to_ndarray(results)
+        success = int(arr['success'].sum())
 
         return {
             'total': total,
             'success': success,
             'failed': total - success,
             'success_rate': success / total if total > 0 else 0,
-            'total_fragments': sum(r.fragments_created for r in results),
-            'total_matched_amount': sum(r.total_matched for r in results)
+            'total_fragments': int(arr['fragments'].sum()),
+            'total_matched_amount': Decimal(int(arr['matched'].sum())).scaleb(-2)
         }
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""
+贪婪分配内核（Numba 加速，可选）
+
+金额统一以"分"（int64）表示，候选集以结构数组（SoA）传入：
+line_ids / remaining_cents 两个按 remaining 升序排列的 int64 数组。
+分配逻辑与 GreedyMatchingEngine.match_single 一致，仅在最终返回结果时还原为 Decimal。
+未安装 numba 时退化为同样逻辑的纯 Python 实现。
+"""
+
+from decimal import Decimal
+from typing import List, Tuple
+import numpy as np
+
+from .matching_engine import BlueLineItem, NegativeInvoice, MatchAllocation, MatchResult, FailureReasons
+
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# 允许的误差：1分钱（与 match_single 的 Decimal('0.01') 对应）
+TOLERANCE_CENTS = 1
+
+
+def _greedy_alloc(remaining_cents, line_ids, target_cents, fragment_threshold_cents):
+    """
+    从小到大依次使用候选，直到剩余需求不超过1分钱
+
+    Returns:
+        (分配的蓝票行ID数组, 分配金额数组, 分配后剩余数组, 未满足需求, 碎片数)
+    """
+    n = remaining_cents.shape[0]
+    alloc_ids = np.empty(n, dtype=np.int64)
+    alloc_amounts = np.empty(n, dtype=np.int64)
+    alloc_after = np.empty(n, dtype=np.int64)
+    need = target_cents
+    count = 0
+    fragments = 0
+
+    for i in range(n):
+        if need <= TOLERANCE_CENTS:
+            break
+        use = min(need, remaining_cents[i])
+        after = remaining_cents[i] - use
+        alloc_ids[count] = line_ids[i]
+        alloc_amounts[count] = use
+        alloc_after[count] = after
+        count += 1
+        if 0 < after < fragment_threshold_cents:
+            fragments += 1
+        need -= use
+
+    return alloc_ids[:count], alloc_amounts[:count], alloc_after[:count], need, fragments
+
+
+greedy_alloc = numba.njit(cache=True)(_greedy_alloc) if NUMBA_AVAILABLE else _greedy_alloc
+
+
+def to_cents(amount: Decimal) -> int:
+    """Decimal 金额转换为分（两位小数，精确）"""
+    return int(amount.scaleb(2))
+
+
+def from_cents(cents: int) -> Decimal:
+    """分转换回两位小数的 Decimal"""
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def candidates_to_arrays(candidates: List[BlueLineItem]) -> Tuple[np.ndarray, np.ndarray]:
+    """候选列表转换为 (line_ids, remaining_cents) 两个 int64 数组，保持原有顺序"""
+    line_ids = np.fromiter((c.line_id for c in candidates), dtype=np.int64, count=len(candidates))
+    remaining_cents = np.fromiter((c.remaining_cents for c in candidates),
+                                  dtype=np.int64, count=len(candidates))
+    return line_ids, remaining_cents
+
+
+def match_single_cents(negative: NegativeInvoice,
+                       line_ids: np.ndarray,
+                       remaining_cents: np.ndarray,
+                       fragment_threshold: Decimal = Decimal('5.0')) -> MatchResult:
+    """
+    基于整数分数组匹配单个负数发票，返回与 match_single 相同结构的结果
+
+    不记录 match_attempts / failure_detail（仅用于性能对比和一致性校验）
+    """
+    if line_ids.shape[0] == 0:
+        return MatchResult(
+            negative_invoice_id=negative.invoice_id,
+            success=False,
+            allocations=[],
+            total_matched=Decimal('0'),
+            fragments_created=0,
+            failure_reason=FailureReasons.NO_CANDIDATES
+        )
+
+    target = negative.cents
+    ids, amounts, after, need, fragments = greedy_alloc(
+        remaining_cents, line_ids, target, to_cents(fragment_threshold)
+    )
+    if need > TOLERANCE_CENTS:
+        # 与 match_single 一致：失败时不保留部分分配
+        return MatchResult(
+            negative_invoice_id=negative.invoice_id,
+            success=False,
+            allocations=[],
+            total_matched=Decimal('0'),
+            fragments_created=0,
+            failure_reason=FailureReasons.INSUFFICIENT_TOTAL_AMOUNT
+        )
+
+    return MatchResult(
+        negative_invoice_id=negative.invoice_id,
+        success=True,
+        allocations=[
+            MatchAllocation(blue_line_id=line_id, amount_used=from_cents(amount), remaining_after=from_cents(rest))
+            for line_id, amount, rest in zip(ids.tolist(), amounts.tolist(), after.tolist())
+        ],
+        total_matched=from_cents(target - need),
+        fragments_created=int(fragments),
+        failure_reason=None
+    )
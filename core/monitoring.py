@@ -78,6 +78,16 @@ class SystemMonitor:
                              negatives_count: int,
                              groups_count: int = 1):
         """记录批次执行结果"""
+        # 锁外单次遍历汇总结果，缩短持锁时间
+        success_count = 0
+        matched_amount = Decimal('0')
+        total_fragments = 0
+        for r in results:
+            if r.success:
+                success_count += 1
+                matched_amount += r.total_matched
+                total_fragments += r.fragments_created
+
         with self.lock:
             # 更新性能指标
             self.performance.total_requests += 1
@@ -99,18 +109,12 @@ class SystemMonitor:
             self.business.total_negative_invoices += negatives_count
             self.business.response_times.append(execution_time * 1000)  # 转换为毫秒
 
-            success_count = sum(1 for r in results if r.success)
             self.business.successful_matches += success_count
             self.business.failed_matches += (negatives_count - success_count)
 
-            if results:
-                # 统计金额
-                matched_amount = sum(r.total_matched for r in results if r.success)
-                self.business.total_matched_amount += matched_amount
-
-                # 统计碎片
-                total_fragments = sum(r.fragments_created for r in results if r.success)
-                self.business.fragments_created += total_fragments
+            # 统计金额与碎片
+            self.business.total_matched_amount += matched_amount
+            self.business.fragments_created += total_fragments
 
             # 更新请求成功失败统计
             if success_count == negatives_count:
@@ -40,6 +40,7 @@ class PerformanceReport:
     resource_usage: Dict[str, Any]
     database_statistics: Dict[str, Any]
     timestamp: str
+    step_sums: Dict[str, float] = field(default_factory=dict)  # 各步骤累计耗时（毫秒）
 
 
 class PerformanceTimer:
@@ -50,6 +51,7 @@ class PerformanceTimer:
         self.lock = Lock()
         self.current_sessions = {}
         self.resource_snapshots = []
+        self._step_sums: Dict[str, float] = {}  # 各步骤累计耗时（毫秒），记录时增量维护
 
     def reset(self):
         """重置所有计时记录"""
@@ -57,6 +59,18 @@ class PerformanceTimer:
             self.records.clear()
             self.current_sessions.clear()
             self.resource_snapshots.clear()
+            self._step_sums.clear()
+
+    def _add_record(self, record: TimingRecord):
+        """追加计时记录并累加该步骤的总耗时"""
+        with self.lock:
+            self.records.append(record)
+            self._step_sums[record.name] = self._step_sums.get(record.name, 0.0) + record.duration * 1000
+
+    def get_step_sums(self) -> Dict[str, float]:
+        """各步骤累计耗时（毫秒），O(步骤数)，不遍历计时记录"""
+        with self.lock:
+            return dict(self._step_sums)
 
     @contextmanager
     def measure(self, name: str, metadata: Optional[Dict] = None):
@@ -100,8 +114,7 @@ class PerformanceTimer:
                 metadata=metadata or {}
             )
 
-            with self.lock:
-                self.records.append(record)
+            self._add_record(record)
 
             logger.debug(f"⏱️  {name}: {duration*1000:.2f}ms")
 
@@ -138,8 +151,7 @@ class PerformanceTimer:
             metadata=session['metadata']
         )
 
-        with self.lock:
-            self.records.append(record)
+        self._add_record(record)
 
     def get_step_statistics(self) -> Dict[str, Dict[str, float]]:
         """获取各步骤的统计信息"""
@@ -216,7 +228,8 @@ class PerformanceTimer:
             step_statistics=step_statistics,
             resource_usage=resource_usage,
             database_statistics=database_statistics,
-            timestamp=datetime.now().isoformat()
+            timestamp=datetime.now().isoformat(),
+            step_sums=self.get_step_sums()
         )
 
     def _get_database_statistics(self, db_manager) -> Dict[str, Any]:
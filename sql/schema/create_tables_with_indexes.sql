@@ -90,6 +90,10 @@ CREATE INDEX idx_batch ON blue_lines (batch_id);
 CREATE INDEX idx_batch_status ON blue_lines (batch_id, remaining)
 WHERE batch_id IS NOT NULL;
 
+-- 批次元数据部分索引：按数据规模查找最近完成的批次（性能测试复用已有数据）
+CREATE INDEX idx_batch_meta_completed ON batch_metadata (total_lines, end_time DESC)
+WHERE status = 'completed';
+
 -- 匹配记录索引：优化匹配记录查询
 CREATE INDEX idx_match_batch ON match_records (batch_id);
 CREATE INDEX idx_match_negative ON match_records (negative_invoice_id);
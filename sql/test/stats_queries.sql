@@ -1,46 +1,42 @@
 -- 负数发票匹配系统 - 统计查询
 -- 用于分析数据分布和测试验证
 
--- 余额分布统计
--- @description: 按余额范围统计数据分布，用于了解数据特征
+-- 数据分布统计（单次扫描）
+-- @description: 通过 GROUPING SETS 在一次扫描 blue_lines 中同时得到
+--               余额分布、税率分布和活跃数据统计
+--   section = 'remaining' : 按余额范围统计（sort_key 为展示顺序）
+--   section = 'tax'       : 按税率统计
+--   section = 'total'     : 总行数与有余额（可用于匹配）的行数
 SELECT
     CASE
-        WHEN remaining = 0 THEN '0（已用尽）'
-        WHEN remaining < 50 THEN '1-50元（碎片）'
-        WHEN remaining < 100 THEN '50-100元'
-        WHEN remaining < 500 THEN '100-500元'
-        WHEN remaining < 1000 THEN '500-1000元'
-        ELSE '1000元以上'
-    END as range,
+        WHEN GROUPING(range_label) = 0 THEN 'remaining'
+        WHEN GROUPING(tax_rate) = 0 THEN 'tax'
+        ELSE 'total'
+    END as section,
+    COALESCE(range_label, tax_rate::text) as label,
     COUNT(*) as count,
-    ROUND(COUNT(*) * 100.0 /
-        (SELECT COUNT(*) FROM blue_lines), 2) as percentage
-FROM blue_lines
-GROUP BY range
-ORDER BY
-    CASE range
-        WHEN '0（已用尽）' THEN 0
-        WHEN '1-50元（碎片）' THEN 1
-        WHEN '50-100元' THEN 2
-        WHEN '100-500元' THEN 3
-        WHEN '500-1000元' THEN 4
-        ELSE 5
-    END;
-
--- 税率分布统计
--- @description: 统计各税率的数据量分布
-SELECT tax_rate, COUNT(*),
-       ROUND(COUNT(*) * 100.0 /
-            (SELECT COUNT(*) FROM blue_lines), 2) as percentage
-FROM blue_lines
-GROUP BY tax_rate
-ORDER BY COUNT(*) DESC;
-
--- 活跃数据统计
--- @description: 统计有余额（可用于匹配）的数据比例
-SELECT
     COUNT(*) FILTER (WHERE remaining > 0) as active_count,
-    COUNT(*) as total_count,
-    ROUND(COUNT(*) FILTER (WHERE remaining > 0) * 100.0 /
-          COUNT(*), 2) as active_rate
-FROM blue_lines;
\ No newline at end of file
+    MIN(range_order) as sort_key
+FROM (
+    SELECT
+        tax_rate,
+        remaining,
+        CASE
+            WHEN remaining = 0 THEN '0（已用尽）'
+            WHEN remaining < 50 THEN '1-50元（碎片）'
+            WHEN remaining < 100 THEN '50-100元'
+            WHEN remaining < 500 THEN '100-500元'
+            WHEN remaining < 1000 THEN '500-1000元'
+            ELSE '1000元以上'
+        END as range_label,
+        CASE
+            WHEN remaining = 0 THEN 0
+            WHEN remaining < 50 THEN 1
+            WHEN remaining < 100 THEN 2
+            WHEN remaining < 500 THEN 3
+            WHEN remaining < 1000 THEN 4
+            ELSE 5
+        END as range_order
+    FROM blue_lines
+) b
+GROUP BY GROUPING SETS ((range_label), (tax_rate), ());
@@ -25,6 +25,7 @@ from core.db_manager import DatabaseManager, CandidateProvider
 from config.config import get_db_config
 from tests.test_data_generator import TestDataGenerator
 from decimal import Decimal
+from psycopg2.extras import execute_batch
 import time
 
 
@@ -73,7 +74,7 @@ def run_basic_matching_test():
 
         # 执行匹配
         batch_id = f"test_basic_{int(time.time())}"
-        start_time = time.time()
+        start_time = time.perf_counter_ns()
 
         results = engine.match_batch(
             test_invoices,
@@ -81,7 +82,7 @@ def run_basic_matching_test():
             sort_strategy="amount_desc"
         )
 
-        elapsed = time.time() - start_time
+        elapsed = (time.perf_counter_ns() - start_time) / 1e9
 
         # 保存结果
         save_success = db_manager.save_match_results(results, batch_id)
@@ -135,13 +136,15 @@ def reset_specific_test_changes(db_manager, batch_id):
                 return
 
             # 批量恢复remaining值
+            # 同一蓝票行可能有多条扣减记录，需逐条累加，因此用 execute_batch 分页发送
+            # （而非 UPDATE ... FROM VALUES，后者对同一目标行只更新一次）
             updates = [(amount_used, blue_line_id) for blue_line_id, amount_used in changes]
-            cur.executemany("""
+            execute_batch(cur, """
                 UPDATE blue_lines
                 SET remaining = remaining + %s,
                     last_update = CURRENT_TIMESTAMP
                 WHERE line_id = %s
-            """, updates)
+            """, updates, page_size=500)
 
             # 删除本次测试的匹配记录
             cur.execute("DELETE FROM match_records WHERE batch_id = %s", (batch_id,))
@@ -154,53 +157,56 @@ def reset_specific_test_changes(db_manager, batch_id):
 
 def print_detailed_results_with_candidates(invoices, results, candidate_provider, elapsed):
     """输出详细匹配结果（包含候选集信息）"""
-    print("=== 详细匹配结果 ===")
+    # 先拼接全部输出，最后一次性写出，避免逐行 print
+    lines = ["=== 详细匹配结果 ==="]
 
     for i, (invoice, result) in enumerate(zip(invoices, results)):
-        print(f"\n{i+1}. 负数发票 {invoice.invoice_id}:")
-        print(f"   输入: 金额={invoice.amount}, 税率={invoice.tax_rate}%, "
-              f"买方={invoice.buyer_id}, 卖方={invoice.seller_id}")
+        lines.append(f"\n{i+1}. 负数发票 {invoice.invoice_id}:")
+        lines.append(f"   输入: 金额={invoice.amount}, 税率={invoice.tax_rate}%, "
+                     f"买方={invoice.buyer_id}, 卖方={invoice.seller_id}")
 
         if result.success:
-            print(f"   ✓ 匹配成功 - 总匹配金额: {result.total_matched}")
-            print(f"   最终分配 ({len(result.allocations)} 个蓝票行):")
+            lines.append(f"   ✓ 匹配成功 - 总匹配金额: {result.total_matched}")
+            lines.append(f"   最终分配 ({len(result.allocations)} 个蓝票行):")
             for j, alloc in enumerate(result.allocations[:10], 1):  # 只显示前10个分配
-                print(f"     {j}) 蓝票行 {alloc.blue_line_id}: "
-                      f"使用 {alloc.amount_used}, 剩余 {alloc.remaining_after}")
+                lines.append(f"     {j}) 蓝票行 {alloc.blue_line_id}: "
+                             f"使用 {alloc.amount_used}, 剩余 {alloc.remaining_after}")
             if len(result.allocations) > 10:
-                print(f"     ... 还有 {len(result.allocations) - 10} 个分配")
+                lines.append(f"     ... 还有 {len(result.allocations) - 10} 个分配")
             if result.fragments_created > 0:
-                print(f"   ⚠️  产生碎片: {result.fragments_created} 个")
+                lines.append(f"   ⚠️  产生碎片: {result.fragments_created} 个")
         else:
-            print(f"   ✗ 匹配失败 - 原因: {result.failure_reason}")
-            print(f"   已匹配: {result.total_matched}, "
-                  f"未匹配: {invoice.amount - result.total_matched}")
+            lines.append(f"   ✗ 匹配失败 - 原因: {result.failure_reason}")
+            lines.append(f"   已匹配: {result.total_matched}, "
+                         f"未匹配: {invoice.amount - result.total_matched}")
 
-    print(f"\n执行时间: {elapsed:.3f} 秒")
+    lines.append(f"\n执行时间: {elapsed:.3f} 秒")
+    print("\n".join(lines))
 
 def print_detailed_results(invoices, results, elapsed):
     """输出详细匹配结果（原版本，保持兼容性）"""
-    print("=== 详细匹配结果 ===")
+    lines = ["=== 详细匹配结果 ==="]
 
     for i, (invoice, result) in enumerate(zip(invoices, results)):
-        print(f"\n{i+1}. 负数发票 {invoice.invoice_id}:")
-        print(f"   金额: {invoice.amount}, 税率: {invoice.tax_rate}%, "
-              f"买方: {invoice.buyer_id}, 卖方: {invoice.seller_id}")
+        lines.append(f"\n{i+1}. 负数发票 {invoice.invoice_id}:")
+        lines.append(f"   金额: {invoice.amount}, 税率: {invoice.tax_rate}%, "
+                     f"买方: {invoice.buyer_id}, 卖方: {invoice.seller_id}")
 
         if result.success:
-            print(f"   ✓ 匹配成功 - 总匹配金额: {result.total_matched}")
-            print(f"   使用了 {len(result.allocations)} 个蓝票行:")
+            lines.append(f"   ✓ 匹配成功 - 总匹配金额: {result.total_matched}")
+            lines.append(f"   使用了 {len(result.allocations)} 个蓝票行:")
             for j, alloc in enumerate(result.allocations, 1):
-                print(f"     {j}) 蓝票行 {alloc.blue_line_id}: "
-                      f"使用 {alloc.amount_used}, 剩余 {alloc.remaining_after}")
+                lines.append(f"     {j}) 蓝票行 {alloc.blue_line_id}: "
+                             f"使用 {alloc.amount_used}, 剩余 {alloc.remaining_after}")
             if result.fragments_created > 0:
-                print(f"   ⚠️  产生碎片: {result.fragments_created} 个")
+                lines.append(f"   ⚠️  产生碎片: {result.fragments_created} 个")
         else:
-            print(f"   ✗ 匹配失败 - 原因: {result.failure_reason}")
-            print(f"   已匹配: {result.total_matched}, "
-                  f"未匹配: {invoice.amount - result.total_matched}")
+            lines.append(f"   ✗ 匹配失败 - 原因: {result.failure_reason}")
+            lines.append(f"   已匹配: {result.total_matched}, "
+                         f"未匹配: {invoice.amount - result.total_matched}")
 
-    print(f"\n执行时间: {elapsed:.3f} 秒")
+    lines.append(f"\n执行时间: {elapsed:.3f} 秒")
+    print("\n".join(lines))
 
 def verify_results(results, invoices):
     """验证匹配结果的正确性"""
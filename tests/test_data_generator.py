@@ -32,26 +32,162 @@
 
 import sys
 import os
+import io
 import argparse
+import threading
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import psycopg2
-from psycopg2.extras import execute_values
-import random
+from psycopg2.pool import ThreadedConnectionPool
 import numpy as np
 import time
 from tqdm import tqdm
 from typing import List, Dict, Optional
 from decimal import Decimal
 
+# 可选依赖：Numba JIT 生成内核（未安装时使用 NumPy 向量化路径）
+# Optional dependency: Numba JIT kernel for row generation, falls back to NumPy vectorization
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    numba = None
+    NUMBA_AVAILABLE = False
+
 # 导入核心模块的数据模型
 from core.matching_engine import NegativeInvoice
 
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True)
+    def _fill_blue_line_batch(n, seed, tax_cdf, tax_values, out_tax, out_remaining, out_original):
+        """
+        Numba内核：为一个批次填充税率 / 剩余金额 / 原始金额数组
+        串行循环 + 每批独立种子，保证相同种子下结果可重复
+        """
+        np.random.seed(seed)
+        for k in range(n):
+            # 税率：在累积概率表上线性查找（只有4档）
+            u = np.random.random()
+            t = 0
+            while t < tax_cdf.shape[0] - 1 and u >= tax_cdf[t]:
+                t += 1
+            out_tax[k] = tax_values[t]
+
+            # 剩余金额：与 generate_remaining_amount 相同的分段分布
+            r = np.random.random()
+            if r < 0.60:
+                remaining = 0.0
+            elif r < 0.75:
+                remaining = np.round(np.random.uniform(1.0, 100.0), 2)
+            elif r < 0.85:
+                remaining = np.round(np.random.uniform(100.0, 500.0), 2)
+            elif r < 0.95:
+                remaining = np.round(np.random.uniform(500.0, 2000.0), 2)
+            else:
+                remaining = np.round(np.random.uniform(2000.0, 10000.0), 2)
+            out_remaining[k] = remaining
+
+            # 原始金额
+            if remaining > 0:
+                out_original[k] = np.round(remaining * np.random.uniform(1.2, 2.0), 2)
+            else:
+                out_original[k] = np.round(np.random.uniform(100.0, 1000.0), 2)
+
+# 蓝票行 COPY 语句（文本格式，制表符分隔）
+BLUE_LINES_COPY_SQL = (
+    "COPY blue_lines (ticket_id, tax_rate, buyer_id, seller_id, "
+    "product_name, original_amount, remaining, batch_id) FROM STDIN WITH (FORMAT text)"
+)
+
+# 服务端生成：generate_series 逐行产生行号和均匀随机数，分布参数（累积概率表 / 区间）以数组传入，
+# width_bucket(u, cdf) 等价于 np.searchsorted(cdf, u, side='right')，与客户端生成的分布一致。
+# 内层子查询加 OFFSET 0 防止被上拉，保证每行的 random() 只求值一次
+BLUE_LINES_SERVER_SIDE_SQL = """
+    INSERT INTO blue_lines (
+        ticket_id, tax_rate, buyer_id, seller_id,
+        product_name, original_amount, remaining, batch_id
+    )
+    SELECT %(ticket_base)s + r.g / 100,
+           (%(tax_values)s::smallint[])[width_bucket(r.u_tax, %(tax_cdf)s::float8[]) + 1],
+           (%(buyer_lo)s::int[])[r.tier] + floor(r.u_buyer * ((%(buyer_hi)s::int[])[r.tier] - (%(buyer_lo)s::int[])[r.tier]))::int,
+           (%(seller_lo)s::int[])[r.tier] + floor(r.u_seller * ((%(seller_hi)s::int[])[r.tier] - (%(seller_lo)s::int[])[r.tier]))::int,
+           'Product_' || (r.g %% 1000),
+           CASE WHEN r.remaining > 0 THEN round(r.remaining * (1.2 + 0.8 * r.u_original)::numeric, 2)
+                ELSE round((100 + 900 * r.u_original)::numeric, 2) END,
+           r.remaining,
+           %(batch_id)s
+    FROM (
+        SELECT g, u_tax, u_buyer, u_seller, u_original,
+               width_bucket(u_tier, %(bs_cdf)s::float8[]) + 1 AS tier,
+               round(((%(remaining_lo)s::float8[])[b] + ((%(remaining_hi)s::float8[])[b] - (%(remaining_lo)s::float8[])[b]) * u_amount)::numeric, 2) AS remaining
+        FROM (
+            SELECT g, random() AS u_tax, random() AS u_tier, random() AS u_buyer, random() AS u_seller,
+                   width_bucket(random(), %(remaining_cdf)s::float8[]) + 1 AS b,
+                   random() AS u_amount, random() AS u_original
+            FROM generate_series(%(start)s::bigint, %(end)s::bigint - 1) AS g
+            OFFSET 0
+        ) u
+    ) r
+"""
+
+# 负数发票结构数组的字段类型（generate_negative_invoices_array）
+NEGATIVE_INVOICE_DTYPE = np.dtype([
+    ('id', 'i8'), ('amount', 'f8'), ('tax_rate', 'i4'), ('buyer_id', 'i4'), ('seller_id', 'i4')
+])
+
+
+class BlueLineCopyStream(io.RawIOBase):
+    """
+    蓝票行 COPY 数据流：按需把列式数据格式化为 COPY 文本
+    copy_expert 每次 read 时只格式化下一小段行，不构造整批行元组或完整文本缓冲
+    """
+
+    def __init__(self, columns: tuple, batch_id: str, rows_per_fill: int = 1000):
+        super().__init__()
+        self._columns = columns
+        self._batch_id = batch_id
+        self._rows = len(columns[0])
+        self._pos = 0
+        self._rows_per_fill = rows_per_fill
+        self._buf = bytearray()
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill(self):
+        """格式化接下来的 rows_per_fill 行追加到缓冲区"""
+        start, end = self._pos, min(self._pos + self._rows_per_fill, self._rows)
+        batch_id = self._batch_id
+        ticket_ids, tax_rates, buyer_ids, seller_ids, names, originals, remainings = (
+            column[start:end] for column in self._columns
+        )
+        self._buf += "".join(
+            f"{ticket_id}\t{tax_rate}\t{buyer_id}\t{seller_id}\t{name}\t"
+            f"{original:.2f}\t{remaining:.2f}\t{batch_id}\n"
+            for ticket_id, tax_rate, buyer_id, seller_id, name, original, remaining
+            in zip(ticket_ids, tax_rates, buyer_ids, seller_ids, names, originals, remainings)
+        ).encode()
+        self._pos = end
+
+    def readinto(self, b) -> int:
+        while len(self._buf) < len(b) and self._pos < self._rows:
+            self._fill()
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        del self._buf[:n]
+        return n
+
+
 # SQL工具函数
+@lru_cache(maxsize=None)
 def load_sql_file(filename: str) -> str:
     """
-    加载SQL文件内容
+    加载SQL文件内容（按文件名缓存，同一进程内重复调用不再读盘）
 
     Args:
         filename: SQL文件名，相对于项目根目录的sql/路径
@@ -72,6 +208,25 @@ def load_sql_file(filename: str) -> str:
     except Exception as e:
         raise Exception(f"读取SQL文件失败 {sql_path}: {e}")
 
+@lru_cache(maxsize=None)
+def load_sql_statements(filename: str) -> tuple:
+    """
+    加载SQL文件并拆分为语句列表（按文件名缓存）
+
+    先逐行去掉 -- 注释再按分号拆分，避免以注释开头的语句块被整体跳过
+
+    Args:
+        filename: SQL文件名，相对于项目根目录的sql/路径
+
+    Returns:
+        tuple: 去除注释和空白后的SQL语句
+    """
+    sql = "\n".join(
+        line for line in load_sql_file(filename).splitlines()
+        if not line.strip().startswith('--')
+    )
+    return tuple(stmt.strip() for stmt in sql.split(';') if stmt.strip())
+
 class TestDataGenerator:
     """
     测试数据生成器
@@ -90,29 +245,60 @@ class TestDataGenerator:
             config: 测试配置（可选，用于覆盖默认配置）
             seed: 随机种子（可选，用于生成可重复的测试数据）
         """
+        self.db_config = db_config
         self.conn = psycopg2.connect(**db_config)
         self.cur = self.conn.cursor()
+        self._writer_pool: Optional[ThreadedConnectionPool] = None  # 并发写入时按需创建
 
-        # 设置随机种子（用于可重复测试）
+        # 统一使用单个 PCG64 随机数生成器（设置种子用于可重复测试）
+        self.rng = np.random.default_rng(seed)
+        self.seed = seed
         if seed is not None:
-            random.seed(seed)
-            np.random.seed(seed)
-            self.seed = seed
             print(f"🌱 已设置随机种子: {seed} (数据将完全可重复)")
-        else:
-            self.seed = None
 
         # 使用传入的配置或默认配置
         if config:
             self.total_lines = config.get('total_lines', 10_000_000)
             self.batch_size = config.get('batch_size', 10000)
+            self.use_copy = config.get('use_copy', True)
         else:
             self.total_lines = 10_000_000  # 1000万条
             self.batch_size = 10000  # 批量插入大小
+            self.use_copy = True  # 使用 COPY 导入（表上有触发器等场景可关闭，回退到 INSERT）
+
+        # 批次进度：内存中记录已导入的绝对行数，只在分段提交时写回 batch_metadata
+        self._rows_inserted = 0
+        self._rows_flushed = 0
+        self._progress_stmt_prepared = False
+
+        # 向量化生成的分块大小（行）：与 SQL 批次大小解耦，使每块工作集落在 L2 缓存内
+        self.vector_tile_size = (config or {}).get('vector_tile_size', 4096)
+        self._batch_buffers = None
+
+        # 分段提交：每导入 commit_every_rows 行提交一次，缩短事务、便于断点续传
+        self.commit_every_rows = (config or {}).get('commit_every_rows', 100_000)
+        self._rows_since_commit = 0
 
         # 业务分布参数
         self.tax_rates = [13, 6, 3, 0]
         self.tax_weights = [0.6, 0.25, 0.1, 0.05]
+        # 税率累积概率表：抽一个均匀数后二分查找，替代 rng.choice(p=...) 的逐次校验与累加
+        self._tax_values = np.array(self.tax_rates, dtype=np.int32)
+        self._tax_cdf = np.cumsum(self.tax_weights)
+        self._tax_cdf[-1] = 1.0  # 消除浮点累加误差，保证查找结果不越界
+        self._tax_cdf_list = self._tax_cdf.tolist()
+
+        # 剩余金额分档：60% 为0，其余按 1-100 / 100-500 / 500-2000 / 2000-10000 分档
+        self._remaining_cdf = np.array([0.60, 0.75, 0.85, 0.95])
+        self._remaining_lo = np.array([0.0, 1.0, 100.0, 500.0, 2000.0])
+        self._remaining_hi = np.array([0.0, 100.0, 500.0, 2000.0, 10000.0])
+        self._remaining_cdf_list = self._remaining_cdf.tolist()
+        self._remaining_lo_list = self._remaining_lo.tolist()
+        self._remaining_hi_list = self._remaining_hi.tolist()
+
+        # 标量抽样的均匀数缓冲池：一次批量生成，逐个取用，用完后原地重新填充
+        self._uniform_pool = self.rng.random((config or {}).get('uniform_pool_size', 1 << 16))
+        self._uniform_idx = 0
 
         # 买卖方配置
         self._init_buyer_seller_config()
@@ -130,18 +316,43 @@ class TestDataGenerator:
         self.all_buyers = list(range(1, 101))     # 所有100个买方 (20%概率，原来是1000)
         self.all_sellers = list(range(1, 101))    # 所有100个卖方
 
+        # 分层累积概率表 (CDF) + 各层区间 [lo, hi)，用于二分查找向量化抽样
+        # Tier CDF plus per-tier [lo, hi) bounds for searchsorted-based sampling
+        self._bs_cdf = np.array([0.40, 0.80, 1.0])
+        self._buyer_lo = np.array([self.hot_buyers[0], self.regular_buyers[0], self.all_buyers[0]])
+        self._buyer_hi = np.array([self.hot_buyers[-1], self.regular_buyers[-1], self.all_buyers[-1]]) + 1
+        self._seller_lo = np.array([self.hot_sellers[0], self.regular_sellers[0], self.all_sellers[0]])
+        self._seller_hi = np.array([self.hot_sellers[-1], self.regular_sellers[-1], self.all_sellers[-1]]) + 1
+        # 标量路径使用的同一份表（Python int，避免逐次访问 NumPy 标量）
+        self._bs_cdf_list = self._bs_cdf.tolist()
+        self._buyer_lo_list, self._buyer_hi_list = self._buyer_lo.tolist(), self._buyer_hi.tolist()
+        self._seller_lo_list, self._seller_hi_list = self._seller_lo.tolist(), self._seller_hi.tolist()
+
+        # 商品名称查找表（避免逐行格式化字符串）
+        self._product_names = [f"Product_{i}" for i in range(1000)]
+        self._product_names_arr = np.array(self._product_names, dtype=object)  # 批量路径按下标整列取值
+
         print(f"📊 数据分布配置:")
         print(f"  热门买卖方: {len(self.hot_buyers)}x{len(self.hot_sellers)} = {len(self.hot_buyers)*len(self.hot_sellers)} 组合")
         print(f"  常规买卖方: {len(self.regular_buyers)}x{len(self.regular_sellers)} = {len(self.regular_buyers)*len(self.regular_sellers)} 组合")
         print(f"  全部买卖方: {len(self.all_buyers)}x{len(self.all_sellers)} = {len(self.all_buyers)*len(self.all_sellers)} 组合")
     
-    def setup_database(self):
-        """设置数据库：创建表和索引"""
+    def setup_database(self, unlogged: bool = False):
+        """
+        设置数据库：创建表和索引
+
+        Args:
+            unlogged: 以 UNLOGGED 方式创建 blue_lines（不写WAL，适合可丢弃的测试数据）
+        """
         print("创建数据库表和索引...")
+        if unlogged:
+            print("  ⚠️ blue_lines 将以 UNLOGGED 方式创建（数据库崩溃后数据会被清空）")
 
         # 优先使用合并的SQL文件（包含表和索引）
         try:
             combined_sql = load_sql_file('schema/create_tables_with_indexes.sql')
+            if unlogged:
+                combined_sql = self._make_blue_lines_unlogged(combined_sql)
             self.cur.execute(combined_sql)
             self.conn.commit()
             print("✓ 数据库表和索引创建完成（使用合并文件）")
@@ -151,6 +362,8 @@ class TestDataGenerator:
 
             # 创建表
             create_tables_sql = load_sql_file('schema/create_tables.sql')
+            if unlogged:
+                create_tables_sql = self._make_blue_lines_unlogged(create_tables_sql)
             self.cur.execute(create_tables_sql)
             self.conn.commit()
             print("  ✓ 数据库表创建完成")
@@ -166,9 +379,32 @@ class TestDataGenerator:
             print(f"❌ 数据库设置失败: {e}")
             raise
     
+    @staticmethod
+    def _make_blue_lines_unlogged(ddl: str) -> str:
+        """将建表DDL中的 blue_lines 改为 UNLOGGED 表"""
+        return ddl.replace("CREATE TABLE blue_lines", "CREATE UNLOGGED TABLE blue_lines", 1)
+
+    def _set_bulk_load_settings(self, enabled: bool):
+        """
+        批量导入期间的会话级设置：关闭同步提交、加大索引构建内存
+        wal_compression 需要超级用户权限，这里不做设置
+        """
+        if enabled:
+            self.cur.execute("SET synchronous_commit = off")
+            self.cur.execute("SET maintenance_work_mem = '1GB'")
+        else:
+            self.cur.execute("RESET synchronous_commit")
+            self.cur.execute("RESET maintenance_work_mem")
+        self.conn.commit()
+
     def generate_blue_lines(self, total_lines: Optional[int] = None,
                            batch_id: Optional[str] = None,
-                           resume_from: Optional[int] = None):
+                           resume_from: Optional[int] = None,
+                           defer_indexes: bool = False,
+                           workers: int = 1,
+                           writers: int = 1,
+                           verify_resume: bool = False,
+                           server_side: bool = False):
         """
         生成蓝票行数据（支持断点续传和幂等性）
 
@@ -176,6 +412,11 @@ class TestDataGenerator:
             total_lines: 总行数
             batch_id: 批次ID（默认生成时间戳）
             resume_from: 从第N条开始（断点续传，自动检测）
+            defer_indexes: 导入前删除 blue_lines 二级索引，导入后一次性重建
+            workers: 行生成进程数（>1 时多进程生成）
+            writers: COPY 写入连接数（>1 时通过连接池多连接并发写入）
+            verify_resume: 续传前用 COUNT(*) 核对实际行数（默认信任 batch_metadata）
+            server_side: 在 PostgreSQL 端用 generate_series 生成数据（INSERT ... SELECT），不经客户端格式化和传输
         """
         if total_lines is None:
             total_lines = self.total_lines
@@ -191,123 +432,453 @@ class TestDataGenerator:
         max_ticket_id = self.cur.fetchone()[0]
 
         # 检查批次状态
-        resume_from = self._check_batch_status(batch_id, total_lines, resume_from)
+        resume_from = self._check_batch_status(batch_id, total_lines, resume_from, verify=verify_resume)
 
         if resume_from and resume_from >= total_lines:
             print(f"批次 {batch_id} 已完成，无需继续生成")
             return batch_id
-        insert_sql = """
-            INSERT INTO blue_lines (
-                ticket_id, tax_rate, buyer_id, seller_id,
-                product_name, original_amount, remaining, batch_id
-            ) VALUES %s
-        """
-
-        batch_data = []
-        ticket_id = max_ticket_id + 1  # 从最大ID开始，避免冲突
-
         # 调整起始位置
         start_from = resume_from or 0
         actual_lines = total_lines - start_from
-        
-        with tqdm(total=actual_lines, initial=0) as pbar:
-            for i in range(start_from, total_lines):
-                # 每100行属于同一张票据
-                if i % 100 == 0:
-                    ticket_id += 1
-
-                # 生成数据（包含batch_id）
-                data = self._generate_single_blue_line(i, ticket_id, batch_id)
-                batch_data.append(data)
-
-                # 批量插入
-                if len(batch_data) >= self.batch_size:
-                    execute_values(self.cur, insert_sql, batch_data)
-                    self._update_batch_progress(batch_id, len(batch_data))
-                    batch_data = []
-                    pbar.update(self.batch_size)
-            # 插入剩余数据
-            if batch_data:
-                execute_values(self.cur, insert_sql, batch_data)
-                self._update_batch_progress(batch_id, len(batch_data))
-                pbar.update(len(batch_data))
 
-        self.conn.commit()
+        # 每100行属于同一张票据：第i行的票据号 = 起始票据号 + 已跨越的100行边界数
+        ticket_base = max_ticket_id + 1 - (start_from - 1) // 100  # 从最大ID开始，避免冲突
+
+        # 延迟索引：先删除二级索引，避免逐行维护B树
+        deferred_indexes = self._drop_blue_line_indexes() if defer_indexes else []
+        self._set_bulk_load_settings(True)
+
+        self._rows_inserted = self._rows_flushed = start_from
+
+        try:
+            with tqdm(total=actual_lines, initial=0) as pbar:
+                if server_side:
+                    if workers > 1 or writers > 1:
+                        print("  ⚠️ 服务端生成为单条 INSERT ... SELECT，忽略 workers / writers 设置")
+                    # 每段一条语句，段大小与分段提交一致，保留进度写回和断点续传
+                    for chunk_start in range(start_from, total_lines, self.commit_every_rows):
+                        chunk_end = min(chunk_start + self.commit_every_rows, total_lines)
+                        self._insert_blue_lines_server_side(chunk_start, chunk_end, ticket_base, batch_id)
+                        rows = chunk_end - chunk_start
+                        self._update_batch_progress(batch_id, rows)
+                        self._commit_chunk_if_due(batch_id, rows)
+                        pbar.update(rows)
+                elif not self.use_copy:
+                    if workers > 1 or writers > 1:
+                        print("  ⚠️ 多进程生成/并发写入依赖 COPY，已回退为单进程 INSERT")
+                    for batch_start in range(start_from, total_lines, self.batch_size):
+                        batch_end = min(batch_start + self.batch_size, total_lines)
+                        columns = self._build_blue_line_batch(batch_start, batch_end, ticket_base)
+                        self._insert_blue_lines(columns, batch_id)
+                        rows = batch_end - batch_start
+                        self._update_batch_progress(batch_id, rows)
+                        self._commit_chunk_if_due(batch_id, rows)
+                        pbar.update(rows)
+                else:
+                    chunks = self._iter_copy_chunks(start_from, total_lines, ticket_base, batch_id, workers)
+                    if writers > 1:
+                        self._copy_chunks_concurrently(chunks, batch_id, writers, pbar, start_from)
+                    else:
+                        # 批量写入（COPY FROM STDIN）
+                        for stream, rows in chunks:
+                            self.cur.copy_expert(BLUE_LINES_COPY_SQL, stream)
+                            self._update_batch_progress(batch_id, rows)
+                            self._commit_chunk_if_due(batch_id, rows)
+                            pbar.update(rows)
+
+            self._flush_batch_progress(batch_id)
+            self.conn.commit()
+            self._rows_since_commit = 0
+        except Exception:
+            # 未提交分段的数据已回滚，其进度同样作废；已提交分段可断点续传
+            self._rows_inserted = self._rows_flushed
+            self._rows_since_commit = 0
+            self.conn.rollback()
+            raise
+        finally:
+            # 无论导入成功与否都要恢复索引
+            if deferred_indexes:
+                self._recreate_blue_line_indexes(deferred_indexes)
+            self._set_bulk_load_settings(False)
 
         # 标记批次完成
         self._mark_batch_completed(batch_id)
         print(f"✓ {total_lines:,}条蓝票行数据生成完成（批次ID: {batch_id}）")
         return batch_id
     
-    def _generate_single_blue_line(self, index: int, ticket_id: int, batch_id: str):
+    def _build_blue_line_batch(self, batch_start: int, batch_end: int, ticket_base: int) -> tuple:
         """
-        生成单条蓝票行数据
-        复用之前的数据生成逻辑，增加batch_id
+        生成 [batch_start, batch_end) 区间的蓝票行数据（列式）
+        各列整批向量化生成，不构造逐行元组
+
+        Returns:
+            (ticket_ids, tax_rates, buyer_ids, seller_ids, product_names, original_amounts, remainings)
         """
-        tax_rate = int(np.random.choice(self.tax_rates, p=self.tax_weights))  # 转换为Python int
-        buyer_id, seller_id = self.generate_buyer_seller()
-        remaining = self.generate_remaining_amount()
-        original_amount = remaining * random.uniform(1.2, 2.0) if remaining > 0 else random.uniform(100, 1000)
-        product_name = f"Product_{index % 1000}"
+        n = batch_end - batch_start
+        buyers, sellers, tax_rates, remaining, original_amount = self._get_batch_buffers(n)
+
+        # 按 vector_tile_size 分块生成：每块的中间数组（CDF查找、均匀数等）可留在 L2 缓存中，
+        # 结果写入复用的预分配输出数组
+        tile = self.vector_tile_size
+        for lo in range(0, n, tile):
+            hi = min(lo + tile, n)
+            # 整块向量化抽取买卖方，避免逐行分支 + random.choice
+            buyers[lo:hi], sellers[lo:hi] = self.generate_buyer_seller_batch(hi - lo)
+            if NUMBA_AVAILABLE:
+                columns = self._generate_blue_line_columns_numba(hi - lo)
+            else:
+                columns = self._generate_blue_line_columns(hi - lo)
+            tax_rates[lo:hi], remaining[lo:hi], original_amount[lo:hi] = columns
+
+        indices = np.arange(batch_start, batch_end)
+        ticket_ids = ticket_base + indices // 100
+        names = self._product_names_arr[indices % 1000].tolist()
 
         return (
-            ticket_id, tax_rate, buyer_id, seller_id,
-            product_name, round(original_amount, 2), remaining, batch_id
+            ticket_ids.tolist(), tax_rates.tolist(), buyers.tolist(), sellers.tolist(),
+            names, original_amount.tolist(), remaining.tolist()
         )
-    
+
+    def _get_batch_buffers(self, n: int) -> tuple:
+        """
+        返回长度为 n 的预分配输出数组视图（买方、卖方、税率、剩余金额、原始金额）
+        缓冲区按最大批次分配一次，跨批次复用，避免每批重新申请内存
+        """
+        if self._batch_buffers is None or len(self._batch_buffers[0]) < n:
+            self._batch_buffers = (
+                np.empty(n, dtype=np.int64), np.empty(n, dtype=np.int64),
+                np.empty(n, dtype=np.int32), np.empty(n, dtype=np.float64),
+                np.empty(n, dtype=np.float64)
+            )
+        return tuple(buf[:n] for buf in self._batch_buffers)
+
+    def _generate_blue_line_columns(self, n: int):
+        """
+        向量化生成一个批次的税率 / 剩余金额 / 原始金额列
+        分布与 generate_remaining_amount 一致：先按累积概率定档，再在档内均匀抽样
+
+        Returns:
+            (tax_rates, remaining, original_amount)
+        """
+        tax_rates = self.generate_tax_rates_batch(n)
+
+        bucket = np.searchsorted(self._remaining_cdf, self.rng.random(n), side='right')
+        remaining = np.round(
+            self.rng.uniform(self._remaining_lo[bucket], self._remaining_hi[bucket]), 2
+        )
+        original_amount = np.round(np.where(
+            remaining > 0,
+            remaining * self.rng.uniform(1.2, 2.0, n),
+            self.rng.uniform(100, 1000, n)
+        ), 2)
+        return tax_rates, remaining, original_amount
+
+    def _build_blue_line_copy_bytes(self, batch_start: int, batch_end: int, ticket_base: int,
+                                    batch_id: str, seed: int) -> bytes:
+        """
+        工作进程入口：用独立种子生成一个批次并格式化为 COPY 文本
+        每批种子由主进程顺序抽取，因此多进程结果与完成顺序无关、可重复
+        """
+        self.rng = np.random.default_rng(seed)
+        columns = self._build_blue_line_batch(batch_start, batch_end, ticket_base)
+        return BlueLineCopyStream(columns, batch_id).read()
+
+    def _iter_copy_chunks(self, start_from: int, total_lines: int, ticket_base: int,
+                          batch_id: str, workers: int):
+        """
+        按批次产出 (COPY数据流, 行数)
+
+        workers<=1 时在当前进程逐批生成；workers>1 时多进程生成：
+        各工作进程负责互不重叠的行区间（票据号由行号推导，天然不冲突），
+        按提交顺序产出结果，最多保留 workers*2 个在途批次以限制内存
+        """
+        if workers <= 1:
+            for batch_start in range(start_from, total_lines, self.batch_size):
+                batch_end = min(batch_start + self.batch_size, total_lines)
+                columns = self._build_blue_line_batch(batch_start, batch_end, ticket_base)
+                yield BlueLineCopyStream(columns, batch_id), batch_end - batch_start
+            return
+
+        ranges = list(range(start_from, total_lines, self.batch_size))
+        seeds = self.rng.integers(0, 2**31 - 1, size=len(ranges))
+        tasks = iter(zip(ranges, seeds))
+        print(f"  使用 {workers} 个进程并行生成数据")
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque()
+
+            def submit_next() -> bool:
+                task = next(tasks, None)
+                if task is None:
+                    return False
+                batch_start, seed = task
+                batch_end = min(batch_start + self.batch_size, total_lines)
+                future = executor.submit(self._build_blue_line_copy_bytes, batch_start,
+                                         batch_end, ticket_base, batch_id, int(seed))
+                in_flight.append((future, batch_end - batch_start))
+                return True
+
+            for _ in range(workers * 2):
+                if not submit_next():
+                    break
+
+            while in_flight:
+                future, rows = in_flight.popleft()
+                data = future.result()
+                submit_next()
+                yield io.BytesIO(data), rows
+
+    def _copy_chunks_concurrently(self, chunks, batch_id: str, writers: int, pbar, start_from: int = 0):
+        """
+        多连接并发 COPY 写入
+
+        从连接池取连接，各批次的 COPY 并发执行，但按批次顺序提交：
+        每个批次等前一批次提交后，才在同一事务内写入绝对进度并提交。
+        已提交的行因此始终是从 start_from 开始的连续前缀，batch_metadata.inserted_lines 即续传位置；
+        任一批次失败后，其后的批次全部回滚，续传不会重复插入
+        """
+        pool = self._get_writer_pool(writers)
+        print(f"  使用 {writers} 个数据库连接并发写入")
+
+        aborted = threading.Event()
+
+        def write_chunk(stream, rows: int, chunk_end: int, prev_committed: threading.Event,
+                        committed: threading.Event):
+            conn = pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SET LOCAL synchronous_commit = off")
+                    cur.copy_expert(BLUE_LINES_COPY_SQL, stream)
+                    prev_committed.wait()
+                    if aborted.is_set():
+                        raise RuntimeError(f"前序批次写入失败，放弃提交至第 {chunk_end:,} 行的批次")
+                    cur.execute("""
+                        UPDATE batch_metadata
+                        SET inserted_lines = %s
+                        WHERE batch_id = %s
+                    """, (chunk_end, batch_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                # 等前序批次结束后再标记失败，前序批次仍可正常提交
+                prev_committed.wait()
+                aborted.set()
+                raise
+            finally:
+                # 无论成功与否都唤醒下一批次（失败时它会看到 aborted 并回滚）
+                committed.set()
+                pool.putconn(conn)
+            return rows
+
+        # 线程池按提交顺序取任务，等待中的批次的前序批次一定已在执行或已结束，不会死锁
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            in_flight = deque()
+            prev_committed = threading.Event()
+            prev_committed.set()
+            chunk_end = start_from
+            for stream, rows in chunks:
+                chunk_end += rows
+                committed = threading.Event()
+                in_flight.append(executor.submit(write_chunk, stream, rows, chunk_end, prev_committed, committed))
+                prev_committed = committed
+                if len(in_flight) >= writers * 2:
+                    pbar.update(in_flight.popleft().result())
+            while in_flight:
+                pbar.update(in_flight.popleft().result())
+
+    def _get_writer_pool(self, size: int) -> ThreadedConnectionPool:
+        """懒加载并发写入用的连接池（线程安全版本）"""
+        if self._writer_pool is None:
+            self._writer_pool = ThreadedConnectionPool(1, size, **self.db_config)
+        return self._writer_pool
+
+    def __getstate__(self):
+        """序列化到工作进程时不携带数据库连接"""
+        state = self.__dict__.copy()
+        state.pop('conn', None)
+        state.pop('cur', None)
+        state.pop('db_config', None)
+        state.pop('_writer_pool', None)
+        state['_batch_buffers'] = None
+        return state
+
+    def _drop_blue_line_indexes(self) -> List[tuple]:
+        """
+        删除 blue_lines 上的二级索引（主键/约束索引保留），返回 (索引名, 定义) 列表用于重建
+        """
+        self.cur.execute("""
+            SELECT i.indexname, i.indexdef
+            FROM pg_indexes i
+            WHERE i.schemaname = current_schema()
+              AND i.tablename = 'blue_lines'
+              AND NOT EXISTS (
+                  SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname
+              )
+        """)
+        indexes = self.cur.fetchall()
+
+        if indexes:
+            print(f"  延迟索引：暂时删除 {len(indexes)} 个索引")
+            for index_name, _ in indexes:
+                self.cur.execute(f'DROP INDEX IF EXISTS "{index_name}"')
+            self.conn.commit()
+        return indexes
+
+    def _recreate_blue_line_indexes(self, indexes: List[tuple]):
+        """按保存的定义重建索引并更新统计信息"""
+        print(f"\n重建 {len(indexes)} 个索引...")
+        for index_name, index_def in indexes:
+            print(f"  创建索引 {index_name}...")
+            start_time = time.time()
+            self.cur.execute(index_def)
+            self.conn.commit()
+            print(f"    ✓ 完成 (耗时: {time.time() - start_time:.2f}秒)")
+
+        self.cur.execute("ANALYZE blue_lines")
+        self.conn.commit()
+        print("✓ 索引重建完成")
+
+    def _insert_blue_lines(self, columns: tuple, batch_id: str):
+        """
+        不使用 COPY 时的写入路径：INSERT ... SELECT FROM unnest(...)
+        按列传入数组，规划器只看到一个行源，避免超长 VALUES 列表的解析开销
+        """
+        self.cur.execute("""
+            INSERT INTO blue_lines (
+                ticket_id, tax_rate, buyer_id, seller_id,
+                product_name, original_amount, remaining, batch_id
+            )
+            SELECT t.ticket_id, t.tax_rate, t.buyer_id, t.seller_id,
+                   t.product_name, t.original_amount, t.remaining, %s
+            FROM unnest(
+                %s::bigint[], %s::smallint[], %s::integer[], %s::integer[],
+                %s::varchar[], %s::numeric[], %s::numeric[]
+            ) AS t(ticket_id, tax_rate, buyer_id, seller_id,
+                   product_name, original_amount, remaining)
+        """, (batch_id, *columns))
+
+    def _insert_blue_lines_server_side(self, batch_start: int, batch_end: int,
+                                       ticket_base: int, batch_id: str):
+        """
+        服务端生成 [batch_start, batch_end) 区间的蓝票行：一次往返，行数据不经过客户端
+        服务端随机数种子取自 self.rng，因此 --seed 下数据仍然可重复（数值与客户端路径不同）
+        """
+        self.cur.execute("SELECT setseed(%s)", (float(self.rng.uniform(-1.0, 1.0)),))
+        self.cur.execute(BLUE_LINES_SERVER_SIDE_SQL, {
+            'start': batch_start, 'end': batch_end,
+            'ticket_base': ticket_base, 'batch_id': batch_id,
+            'tax_values': self._tax_values.tolist(), 'tax_cdf': self._tax_cdf_list,
+            'bs_cdf': self._bs_cdf_list,
+            'buyer_lo': self._buyer_lo_list, 'buyer_hi': self._buyer_hi_list,
+            'seller_lo': self._seller_lo_list, 'seller_hi': self._seller_hi_list,
+            'remaining_cdf': self._remaining_cdf_list,
+            'remaining_lo': self._remaining_lo_list, 'remaining_hi': self._remaining_hi_list,
+        })
+
+    def _generate_blue_line_columns_numba(self, n: int):
+        """
+        使用Numba内核生成一个批次的税率 / 剩余金额 / 原始金额列
+        内核种子取自 self.rng，因此 --seed 下数据仍然可重复
+        """
+        out_tax = np.empty(n, dtype=np.int32)
+        out_remaining = np.empty(n, dtype=np.float64)
+        out_original = np.empty(n, dtype=np.float64)
+        kernel_seed = int(self.rng.integers(0, 2**31 - 1))
+        _fill_blue_line_batch(n, kernel_seed, self._tax_cdf, self._tax_values,
+                              out_tax, out_remaining, out_original)
+        return out_tax, out_remaining, out_original
+
+    def generate_tax_rate(self) -> int:
+        """按业务权重抽取单个税率"""
+        return self.tax_rates[bisect_right(self._tax_cdf_list, self.rng.random())]
+
+    def generate_tax_rates_batch(self, n: int) -> np.ndarray:
+        """按业务权重批量抽取税率（累积概率表上 searchsorted）"""
+        return self._tax_values[np.searchsorted(self._tax_cdf, self.rng.random(n), side='right')]
+
+    def _next_uniform(self) -> float:
+        """从缓冲池取一个 [0, 1) 均匀数，避免每次标量调用都进入 Generator"""
+        if self._uniform_idx >= self._uniform_pool.size:
+            self.rng.random(out=self._uniform_pool)
+            self._uniform_idx = 0
+        u = self._uniform_pool[self._uniform_idx]
+        self._uniform_idx += 1
+        return float(u)
+
     def generate_remaining_amount(self):
         """
         生成更贴近真实场景的remaining金额分布
         减少完全用完的比例，增加有效剩余金额
+        60% 为0 / 15% 1-100 / 10% 100-500 / 10% 500-2000 / 5% 2000-10000
         """
-        rand = random.random()
-        if rand < 0.60:  # 60% remaining = 0 (从70%降低)
+        bucket = bisect_right(self._remaining_cdf_list, self._next_uniform())
+        if bucket == 0:
             return 0
-        elif rand < 0.75:  # 15% 小额 1-100 (从12%增加)
-            return round(random.uniform(1, 100), 2)
-        elif rand < 0.85:  # 10% 中额 100-500 (从6%增加)
-            return round(random.uniform(100, 500), 2)
-        elif rand < 0.95:  # 10% 大额 500-2000 (从3%大幅增加)
-            return round(random.uniform(500, 2000), 2)
-        else:  # 5% 超大额 2000-10000 (从1%增加且金额范围扩大)
-            return round(random.uniform(2000, 10000), 2)
-    
+        lo = self._remaining_lo_list[bucket]
+        hi = self._remaining_hi_list[bucket]
+        return round(lo + (hi - lo) * self._next_uniform(), 2)
+
     def generate_buyer_seller(self):
         """
         生成买卖方组合（优化版）
-        调整概率分布，增加热门组合密度
+        调整概率分布，增加热门组合密度：40% 热门 / 40% 常规 / 20% 长尾
         """
-        rand = random.random()
-        if rand < 0.40:  # 40% 热门组合（提高从30%）
-            buyer = random.choice(self.hot_buyers)
-            seller = random.choice(self.hot_sellers)
-        elif rand < 0.80:  # 40% 常规组合（保持40%）
-            buyer = random.choice(self.regular_buyers)
-            seller = random.choice(self.regular_sellers)
-        else:  # 20% 长尾组合（保持20%）
-            buyer = random.choice(self.all_buyers)
-            seller = random.choice(self.all_sellers)
+        # 分层CDF上二分定位层级，层内用有界整数抽样（Generator.integers 为 Lemire 算法）
+        tier = bisect_right(self._bs_cdf_list, self.rng.random())
+        buyer = int(self.rng.integers(self._buyer_lo_list[tier], self._buyer_hi_list[tier]))
+        seller = int(self.rng.integers(self._seller_lo_list[tier], self._seller_hi_list[tier]))
         return buyer, seller
-    
-    def create_indexes(self):
-        """创建索引（包括部分索引）"""
-        print("\n创建索引...")
 
-        # 从SQL文件加载索引语句
-        indexes_sql = load_sql_file('schema/create_indexes.sql')
+    def generate_buyer_seller_batch(self, n: int):
+        """
+        批量生成买卖方组合（向量化）
+        先在分层CDF上二分查找得到层级，再在层内区间独立抽取买方和卖方
+
+        Args:
+            n: 生成数量
+
+        Returns:
+            (buyers, sellers): 两个长度为n的整数数组
+        """
+        tier = np.searchsorted(self._bs_cdf, self.rng.random(n), side='right')
+        buyers = self.rng.integers(self._buyer_lo[tier], self._buyer_hi[tier])
+        sellers = self.rng.integers(self._seller_lo[tier], self._seller_hi[tier])
+        return buyers, sellers
+
+    def create_indexes(self, verbose: bool = False, parallel: int = 1):
+        """
+        创建索引（包括部分索引）
+
+        Args:
+            verbose: 逐条执行并输出每个索引的耗时；默认整个脚本一次提交执行（单次往返）
+            parallel: 并行建索引的连接数（>1 时各索引在独立连接上同时构建）
+        """
+        print("\n创建索引...")
+        self._set_index_build_settings(self.cur)
+        self.conn.commit()
 
-        # 按分号分割多个SQL语句
-        statements = [stmt.strip() for stmt in indexes_sql.split(';') if stmt.strip()]
+        if parallel > 1:
+            self._create_indexes_parallel(parallel)
+            return
 
-        for stmt in statements:
-            # 跳过注释行
-            if stmt.startswith('--') or not stmt.strip():
-                continue
+        if not verbose:
+            start_time = time.time()
+            try:
+                self.cur.execute(load_sql_file('schema/create_indexes.sql'))
+                self.conn.commit()
+                print(f"✓ 索引创建完成 (耗时: {time.time() - start_time:.2f}秒)")
+                return
+            except Exception as e:
+                # 脚本整体失败时回滚，改为逐条执行，单条失败不影响其余索引
+                self.conn.rollback()
+                print(f"  ⚠️ 整体执行失败，改为逐条创建: {e}")
 
+        # 从SQL文件加载索引语句（已去除注释并按分号拆分）
+        for stmt in load_sql_statements('schema/create_indexes.sql'):
             if 'CREATE INDEX' in stmt.upper():
                 # 提取索引名（用于显示进度）
                 try:
-                    idx_name = stmt.split()[2] if len(stmt.split()) > 2 else 'unknown'
+                    idx_name = self._index_name(stmt)
                     print(f"  创建索引 {idx_name}...")
                     start_time = time.time()
                     self.cur.execute(stmt)
@@ -315,6 +886,7 @@ class TestDataGenerator:
                     elapsed = time.time() - start_time
                     print(f"    ✓ 完成 (耗时: {elapsed:.2f}秒)")
                 except Exception as e:
+                    self.conn.rollback()
                     print(f"    ❌ 创建失败: {e}")
             elif stmt.strip().upper().startswith('ANALYZE'):
                 print("  更新统计信息...")
@@ -323,9 +895,65 @@ class TestDataGenerator:
                     self.conn.commit()
                     print("    ✓ 统计信息更新完成")
                 except Exception as e:
+                    self.conn.rollback()
                     print(f"    ❌ 统计更新失败: {e}")
 
         print("✓ 索引创建完成")
+
+    @staticmethod
+    def _index_name(stmt: str) -> str:
+        """从 CREATE INDEX [IF NOT EXISTS] <name> 语句中提取索引名"""
+        tokens = stmt.split()
+        if len(tokens) > 5 and tokens[2].upper() == 'IF':
+            return tokens[5]
+        return tokens[2] if len(tokens) > 2 else 'unknown'
+
+    @staticmethod
+    def _set_index_build_settings(cur):
+        """建索引的会话设置：加大排序内存，允许单个索引使用多个并行维护进程"""
+        cur.execute("SET maintenance_work_mem = '1GB'")
+        cur.execute("SET max_parallel_maintenance_workers = 4")
+
+    def _create_indexes_parallel(self, parallel: int):
+        """
+        多连接并行建索引
+
+        普通 CREATE INDEX 只持有 SHARE 锁，同一张表上的多个构建可以同时进行；
+        CREATE INDEX CONCURRENTLY 在同一张表上只能串行，因此这里不使用 CONCURRENTLY
+        """
+        statements = load_sql_statements('schema/create_indexes.sql')
+        index_statements = [stmt for stmt in statements if 'CREATE INDEX' in stmt.upper()]
+        other_statements = [stmt for stmt in statements if 'CREATE INDEX' not in stmt.upper()]
+        pool = self._get_writer_pool(parallel)
+        print(f"  使用 {parallel} 个连接并行创建 {len(index_statements)} 个索引")
+
+        def build_index(stmt: str):
+            conn = pool.getconn()
+            start_time = time.time()
+            try:
+                with conn.cursor() as cur:
+                    self._set_index_build_settings(cur)
+                    cur.execute(stmt)
+                conn.commit()
+                return self._index_name(stmt), time.time() - start_time, None
+            except Exception as e:
+                conn.rollback()
+                return self._index_name(stmt), time.time() - start_time, e
+            finally:
+                pool.putconn(conn)
+
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            for idx_name, elapsed, error in executor.map(build_index, index_statements):
+                if error is None:
+                    print(f"  ✓ 索引 {idx_name} 完成 (耗时: {elapsed:.2f}秒)")
+                else:
+                    print(f"  ❌ 索引 {idx_name} 创建失败: {error}")
+
+        # 索引全部完成后再更新统计信息
+        for stmt in other_statements:
+            self.cur.execute(stmt)
+        self.conn.commit()
+        print("✓ 索引创建完成")
     
     def generate_negative_invoices_objects(self, scenario="mixed", count: Optional[int] = None) -> List[NegativeInvoice]:
         """
@@ -338,18 +966,23 @@ class TestDataGenerator:
         Returns:
             List[NegativeInvoice]: 负数发票对象列表
         """
-        invoice_data = self.generate_negative_invoices_data(scenario, count)
+        arr = self.generate_negative_invoices_array(scenario, count)
+
+        # 整列换算为整数分，再由整数直接构造 Decimal（避免逐条 str(float) 再解析）
+        amount_cents = np.rint(arr['amount'] * 100).astype(np.int64)
 
         return [
             NegativeInvoice(
-                invoice_id=data['id'],
-                amount=Decimal(str(data['amount'])),
-                tax_rate=data['tax_rate'],
-                buyer_id=data['buyer_id'],
-                seller_id=data['seller_id'],
-                priority=data.get('priority', 0)
+                invoice_id=invoice_id,
+                amount=Decimal(cents).scaleb(-2),
+                tax_rate=tax_rate,
+                buyer_id=buyer_id,
+                seller_id=seller_id
+            )
+            for invoice_id, cents, tax_rate, buyer_id, seller_id in zip(
+                arr['id'].tolist(), amount_cents.tolist(), arr['tax_rate'].tolist(),
+                arr['buyer_id'].tolist(), arr['seller_id'].tolist()
             )
-            for data in invoice_data
         ]
     
     def generate_negative_invoices_data(self, scenario="mixed", count: Optional[int] = None) -> List[Dict]:
@@ -361,23 +994,39 @@ class TestDataGenerator:
             scenario: 场景类型 (small/mixed/stress/custom)
             count: 生成数量（可选，覆盖场景默认数量）
         """
-        negative_data = []
+        arr = self.generate_negative_invoices_array(scenario, count)
+        return [
+            {
+                'id': invoice_id,
+                'amount': amount,
+                'tax_rate': tax_rate,
+                'buyer_id': buyer_id,
+                'seller_id': seller_id
+            }
+            for invoice_id, amount, tax_rate, buyer_id, seller_id in zip(
+                arr['id'].tolist(), arr['amount'].tolist(), arr['tax_rate'].tolist(),
+                arr['buyer_id'].tolist(), arr['seller_id'].tolist()
+            )
+        ]
+
+    def generate_negative_invoices_array(self, scenario="mixed", count: Optional[int] = None) -> np.ndarray:
+        """
+        生成负数发票测试数据（结构数组，按列存储）
 
+        字段为 NEGATIVE_INVOICE_DTYPE（id/amount/tax_rate/buyer_id/seller_id），已按金额降序排列，
+        切片得到的是视图而不是拷贝
+
+        Args:
+            scenario: 场景类型 (small/mixed/stress/custom)
+            count: 生成数量（可选，覆盖场景默认数量）
+        """
         if scenario == "small":
-            # 小额场景：默认200条，10-100元
+            # 小额场景：默认200条，10-100元，税率13/6，买卖方均取热门组合
             total_count = count if count is not None else 200
-            for i in range(total_count):
-                amount = random.uniform(10, 100)
-                tax_rate = random.choice([13, 6])
-                buyer_id = random.choice(self.hot_buyers)
-                seller_id = random.choice(self.hot_sellers)
-                negative_data.append({
-                    'id': i + 1,
-                    'amount': round(amount, 2),
-                    'tax_rate': tax_rate,
-                    'buyer_id': buyer_id,
-                    'seller_id': seller_id
-                })
+            amounts = np.round(self.rng.uniform(10, 100, total_count), 2)
+            tax_rates = np.array([13, 6])[self.rng.integers(0, 2, total_count)]
+            buyers = self.rng.integers(self._buyer_lo_list[0], self._buyer_hi_list[0], total_count)
+            sellers = self.rng.integers(self._seller_lo_list[0], self._seller_hi_list[0], total_count)
 
         elif scenario == "mixed":
             # 混合场景：不同金额范围
@@ -398,106 +1047,86 @@ class TestDataGenerator:
                     (5, 1000, 5000),  # 5条 1000-5000元
                 ]
 
-            id_counter = 1
-            for count_in_range, min_amt, max_amt in ranges:
-                for _ in range(count_in_range):
-                    amount = random.uniform(min_amt, max_amt)
-                    tax_rate = int(np.random.choice(self.tax_rates, p=self.tax_weights))
-                    buyer_id, seller_id = self.generate_buyer_seller()
-                    negative_data.append({
-                        'id': id_counter,
-                        'amount': round(amount, 2),
-                        'tax_rate': tax_rate,
-                        'buyer_id': buyer_id,
-                        'seller_id': seller_id
-                    })
-                    id_counter += 1
-
-        elif scenario == "stress":
-            # 压力测试：默认1000条随机
-            total_count = count if count is not None else 1000
-            for i in range(total_count):
-                amount = random.uniform(10, 5000)
-                tax_rate = int(np.random.choice(self.tax_rates, p=self.tax_weights))
-                buyer_id, seller_id = self.generate_buyer_seller()
-                negative_data.append({
-                    'id': i + 1,
-                    'amount': round(amount, 2),
-                    'tax_rate': tax_rate,
-                    'buyer_id': buyer_id,
-                    'seller_id': seller_id
-                })
-
-        elif scenario == "custom":
-            # 自定义场景：完全随机
-            total_count = count if count is not None else 100
-            for i in range(total_count):
-                amount = random.uniform(1, 10000)
-                tax_rate = int(np.random.choice(self.tax_rates, p=self.tax_weights))
-                buyer_id, seller_id = self.generate_buyer_seller()
-                negative_data.append({
-                    'id': i + 1,
-                    'amount': round(amount, 2),
-                    'tax_rate': tax_rate,
-                    'buyer_id': buyer_id,
-                    'seller_id': seller_id
-                })
-
-        # 按金额降序排序（大额优先）
-        negative_data.sort(key=lambda x: x['amount'], reverse=True)
-
-        return negative_data
+            # 每个金额区间一次向量化抽样，再对整列统一抽取税率和买卖方
+            amounts = np.round(np.concatenate([
+                self.rng.uniform(min_amt, max_amt, count_in_range)
+                for count_in_range, min_amt, max_amt in ranges
+            ]), 2)
+            tax_rates = self.generate_tax_rates_batch(len(amounts))
+            buyers, sellers = self.generate_buyer_seller_batch(len(amounts))
+
+        elif scenario in ("stress", "custom"):
+            # 压力测试：默认1000条，10-5000元；自定义场景：默认100条，1-10000元
+            if scenario == "stress":
+                total_count = count if count is not None else 1000
+                min_amt, max_amt = 10, 5000
+            else:
+                total_count = count if count is not None else 100
+                min_amt, max_amt = 1, 10000
+            amounts = np.round(self.rng.uniform(min_amt, max_amt, total_count), 2)
+            tax_rates = self.generate_tax_rates_batch(total_count)
+            buyers, sellers = self.generate_buyer_seller_batch(total_count)
+
+        else:
+            return np.empty(0, dtype=NEGATIVE_INVOICE_DTYPE)
+
+        # 按金额降序排序（大额优先）：对整列做稳定 argsort，按列写入结构数组
+        order = np.argsort(-amounts, kind='stable')
+        arr = np.empty(len(order), dtype=NEGATIVE_INVOICE_DTYPE)
+        arr['id'] = order + 1
+        arr['amount'] = amounts[order]
+        arr['tax_rate'] = tax_rates[order]
+        arr['buyer_id'] = buyers[order]
+        arr['seller_id'] = sellers[order]
+
+        return arr
     
     def _print_statistics(self):
         """打印数据统计信息"""
         print("\n数据分布统计：")
 
-        # 从SQL文件加载统计查询
-        stats_sql = load_sql_file('test/stats_queries.sql')
-
-        # 按分号分割多个查询，去除注释行
-        queries = []
-        current_query = []
-
-        for line in stats_sql.split('\n'):
-            line = line.strip()
-            if line.startswith('--') or not line:
-                continue
-            current_query.append(line)
-            if line.endswith(';'):
-                queries.append(' '.join(current_query))
-                current_query = []
-
-        # 执行第一个查询：余额分布
-        if len(queries) >= 1:
-            self.cur.execute(queries[0])
-            print("\nRemaining分布：")
-            for row in self.cur.fetchall():
-                print(f"  {row[0]}: {row[1]:,} ({row[2]}%)")
-
-        # 执行第二个查询：税率分布
-        if len(queries) >= 2:
-            self.cur.execute(queries[1])
-            print("\n税率分布：")
-            for row in self.cur.fetchall():
-                print(f"  {row[0]}%: {row[1]:,} ({row[2]}%)")
-
-        # 执行第三个查询：活跃数据统计
-        if len(queries) >= 3:
-            self.cur.execute(queries[2])
-            row = self.cur.fetchone()
-            print(f"\n活跃数据：{row[0]:,} / {row[1]:,} ({row[2]}%)")
+        # 从SQL文件加载统计查询（GROUPING SETS，一次扫描得到全部分布）
+        self.cur.execute(load_sql_file('test/stats_queries.sql'))
+        rows = self.cur.fetchall()
+
+        remaining_rows = sorted((r for r in rows if r[0] == 'remaining'), key=lambda r: r[4])
+        tax_rows = sorted((r for r in rows if r[0] == 'tax'), key=lambda r: r[2], reverse=True)
+        total_row = next((r for r in rows if r[0] == 'total'), None)
+        total_count = total_row[2] if total_row else 0
+
+        def percentage(count: int) -> float:
+            return round(count * 100.0 / total_count, 2) if total_count else 0
+
+        # 余额分布
+        print("\nRemaining分布：")
+        for _, label, count, _, _ in remaining_rows:
+            print(f"  {label}: {count:,} ({percentage(count)}%)")
+
+        # 税率分布
+        print("\n税率分布：")
+        for _, label, count, _, _ in tax_rows:
+            print(f"  {label}%: {count:,} ({percentage(count)}%)")
+
+        # 活跃数据统计
+        if total_row:
+            active_count = total_row[3]
+            print(f"\n活跃数据：{active_count:,} / {total_count:,} ({percentage(active_count)}%)")
 
     # ========== 批次管理方法 ==========
 
-    def _check_batch_status(self, batch_id: str, total_lines: int, resume_from: Optional[int] = None) -> Optional[int]:
+    def _check_batch_status(self, batch_id: str, total_lines: int, resume_from: Optional[int] = None,
+                            verify: bool = False) -> Optional[int]:
         """
         检查批次状态，支持断点续传
 
+        batch_metadata.inserted_lines 与数据在同一事务内提交，默认直接信任；
+        verify=True 时才对 blue_lines 执行 COUNT(*) 核对（大表上较慢，可走 idx_batch 索引）
+
         Args:
             batch_id: 批次ID
             total_lines: 总行数
             resume_from: 指定的续传位置
+            verify: 是否用实际行数核对续传位置
 
         Returns:
             int: 续传位置（如果需要续传）
@@ -521,6 +1150,11 @@ class TestDataGenerator:
                 print(f"  批次已完成，无需继续")
                 return existing_inserted
 
+            if status == 'running' and not verify:
+                print(f"  从上次中断位置 {existing_inserted:,} 继续")
+                self._mark_resume_event(batch_id, existing_inserted)
+                return existing_inserted
+
             if status == 'running':
                 # 检查实际数据库中的记录数
                 self.cur.execute("""
@@ -535,6 +1169,7 @@ class TestDataGenerator:
                     return actual_count
                 else:
                     print(f"  从上次中断位置 {existing_inserted:,} 继续")
+                    self._mark_resume_event(batch_id, existing_inserted)
                     return existing_inserted
         else:
             # 创建新的批次记录
@@ -552,13 +1187,60 @@ class TestDataGenerator:
         self.conn.commit()
 
     def _update_batch_progress(self, batch_id: str, increment: int):
-        """更新批次进度"""
+        """
+        累加批次进度（仅内存计数，不访问数据库）
+        实际写回在分段提交时由 _flush_batch_progress 一次完成
+        """
+        self._rows_inserted += increment
+
+    def _commit_chunk_if_due(self, batch_id: str, rows: int):
+        """
+        累计行数达到分段阈值时提交事务
+        提交前先刷新进度，保证 batch_metadata 与已提交数据一致（续传位置精确）
+        """
+        self._rows_since_commit += rows
+        if self._rows_since_commit >= self.commit_every_rows:
+            self._flush_batch_progress(batch_id)
+            self.conn.commit()
+            self._rows_since_commit = 0
+
+    def _flush_batch_progress(self, batch_id: str):
+        """
+        将已导入的绝对行数写入 batch_metadata（一条 UPDATE，只改 inserted_lines）
+        写绝对值而非增量：重复执行结果相同，续传时不会累加出错；
+        resumed_at 只在续传事件时由 _mark_resume_event 更新
+        """
+        if self._rows_inserted == self._rows_flushed:
+            return
+        self._prepare_progress_statement()
+        self.cur.execute("EXECUTE set_batch_progress (%s, %s)", (self._rows_inserted, batch_id))
+        self._rows_flushed = self._rows_inserted
+
+    def _prepare_progress_statement(self):
+        """
+        会话内只准备一次进度更新语句，之后 EXECUTE 省去解析/规划开销
+        （预备语句属于会话级，不受事务提交/回滚影响）
+        """
+        if self._progress_stmt_prepared:
+            return
+        self.cur.execute("SELECT 1 FROM pg_prepared_statements WHERE name = 'set_batch_progress'")
+        if self.cur.fetchone() is None:
+            self.cur.execute("""
+                PREPARE set_batch_progress (integer, varchar) AS
+                UPDATE batch_metadata
+                SET inserted_lines = $1
+                WHERE batch_id = $2
+            """)
+        self._progress_stmt_prepared = True
+
+    def _mark_resume_event(self, batch_id: str, resumed_from: int):
+        """记录一次续传事件（续传时间与续传位置），不在导入热路径中调用"""
         self.cur.execute("""
             UPDATE batch_metadata
-            SET inserted_lines = inserted_lines + %s,
-                resumed_at = CURRENT_TIMESTAMP
+            SET resumed_at = CURRENT_TIMESTAMP, resumed_from = %s
             WHERE batch_id = %s
-        """, (increment, batch_id))
+        """, (resumed_from, batch_id))
+        self.conn.commit()
 
     def _update_batch_metadata(self, batch_id: str, total_lines: int, inserted_lines: int, status: str):
         """更新批次元数据"""
@@ -629,22 +1311,12 @@ class TestDataGenerator:
         """重置测试数据（用于重复测试）"""
         print("重置测试数据...")
 
-        # 从SQL文件加载重置语句
-        reset_sql = load_sql_file('test/reset_data.sql')
-
-        # 按分号分割并执行每个语句
-        statements = [stmt.strip() for stmt in reset_sql.split(';') if stmt.strip() and not stmt.strip().startswith('--')]
-
-        for stmt in statements:
-            if stmt.upper().startswith('SELECT'):
-                # 对于验证查询，显示结果
-                self.cur.execute(stmt)
-                result = self.cur.fetchone()
-                if result:
-                    total, restored, inconsistent, avg_remaining, avg_original = result
-                    print(f"  数据验证: 总行数={total:,}, 已恢复={restored:,}, 异常={inconsistent}, 平均余额={avg_remaining}, 平均原始={avg_original}")
-            else:
-                self.cur.execute(stmt)
+        # 整个重置脚本一次执行（单次往返），游标保留最后一条验证查询的结果
+        self.cur.execute(load_sql_file('test/reset_data.sql'))
+        result = self.cur.fetchone()
+        if result:
+            total, restored, inconsistent, avg_remaining, avg_original = result
+            print(f"  数据验证: 总行数={total:,}, 已恢复={restored:,}, 异常={inconsistent}, 平均余额={avg_remaining}, 平均原始={avg_original}")
 
         self.conn.commit()
         print("✓ 测试数据已重置")
@@ -653,23 +1325,13 @@ class TestDataGenerator:
         """强制重置所有数据到完全可用状态（用于性能测试）"""
         print("强制重置数据到完全可用状态...")
 
-        # 从SQL文件加载强制重置语句
-        force_reset_sql = load_sql_file('test/force_reset_data.sql')
-
-        # 按分号分割并执行每个语句
-        statements = [stmt.strip() for stmt in force_reset_sql.split(';') if stmt.strip() and not stmt.strip().startswith('--')]
-
-        for stmt in statements:
-            if stmt.upper().startswith('SELECT'):
-                # 对于验证查询，显示结果
-                self.cur.execute(stmt)
-                result = self.cur.fetchone()
-                if result:
-                    total, available, exhausted, avg_remaining, avg_original, availability = result
-                    print(f"  数据验证: 总行数={total:,}, 完全可用={available:,}, 已用完={exhausted:,}")
-                    print(f"  平均余额={avg_remaining}, 平均原始={avg_original}, 可用性={availability}%")
-            else:
-                self.cur.execute(stmt)
+        # 整个重置脚本一次执行（单次往返），游标保留最后一条验证查询的结果
+        self.cur.execute(load_sql_file('test/force_reset_data.sql'))
+        result = self.cur.fetchone()
+        if result:
+            total, available, exhausted, avg_remaining, avg_original, availability = result
+            print(f"  数据验证: 总行数={total:,}, 完全可用={available:,}, 已用完={exhausted:,}")
+            print(f"  平均余额={avg_remaining}, 平均原始={avg_original}, 可用性={availability}%")
 
         self.conn.commit()
         print("✓ 数据已强制重置到完全可用状态")
@@ -849,6 +1511,9 @@ class TestDataGenerator:
     
     def close(self):
         """关闭数据库连接"""
+        if self._writer_pool is not None:
+            self._writer_pool.closeall()
+            self._writer_pool = None
         self.cur.close()
         self.conn.close()
 
@@ -869,6 +1534,8 @@ def run_generator(args):
         config_overrides['total_lines'] = args.total_lines
     if args.batch_size:
         config_overrides['batch_size'] = args.batch_size
+    if args.no_copy:
+        config_overrides['use_copy'] = False
 
     # 初始化生成器
     generator = TestDataGenerator(db_config, config_overrides)
@@ -880,7 +1547,7 @@ def run_generator(args):
         # 1. 设置数据库（如果需要）
         if args.setup_db:
             print("\n=== 设置数据库 ===")
-            generator.setup_database()
+            generator.setup_database(unlogged=args.unlogged)
 
         # 2. 生成蓝票行数据（如果需要）
         if args.generate_blue_lines:
@@ -888,7 +1555,11 @@ def run_generator(args):
             total_lines = args.total_lines or generator.total_lines
             batch_id = args.batch_id
             resume_from = args.resume_from
-            result_batch_id = generator.generate_blue_lines(total_lines, batch_id, resume_from)
+            result_batch_id = generator.generate_blue_lines(
+                total_lines, batch_id, resume_from,
+                defer_indexes=args.defer_indexes, workers=args.workers, writers=args.writers,
+                verify_resume=args.verify_resume, server_side=args.server_side
+            )
             print(f"批次ID: {result_batch_id}")
 
         # 批次管理操作
@@ -925,7 +1596,7 @@ def run_generator(args):
         # 3. 创建索引（如果需要）
         if args.create_indexes:
             print("\n=== 创建索引 ===")
-            generator.create_indexes()
+            generator.create_indexes(verbose=args.verbose, parallel=args.index_workers)
 
         # 4. 生成示例负数发票（如果需要）
         if args.generate_negatives:
@@ -1004,6 +1675,18 @@ def parse_args():
 性能优化:
   # 调整批次大小以优化性能
   python test_data_generator.py --generate-blue-lines --total-lines 1000000 --batch-size 50000
+
+  # 大批量导入时延迟索引维护（先删索引，导入后重建）
+  python test_data_generator.py --generate-blue-lines --total-lines 10000000 --defer-indexes
+
+  # 多进程生成（主进程负责 COPY 写入）
+  python test_data_generator.py --generate-blue-lines --total-lines 10000000 --workers 4
+
+  # 多进程生成 + 多连接并发 COPY 写入
+  python test_data_generator.py --generate-blue-lines --total-lines 10000000 --workers 4 --writers 4
+
+  # 测试库使用 UNLOGGED 表，省去WAL写入
+  python test_data_generator.py --setup-db --unlogged --generate-blue-lines --total-lines 10000000
         """
     )
 
@@ -1032,6 +1715,22 @@ def parse_args():
                        help='蓝票行总数（默认: 10,000,000）')
     parser.add_argument('--batch-size', type=int,
                        help='批量插入大小（默认: 10,000）')
+    parser.add_argument('--writers', type=int, default=1,
+                       help='并发 COPY 写入的数据库连接数（默认: 1）')
+    parser.add_argument('--index-workers', type=int, default=1,
+                       help='并行建索引的数据库连接数（默认: 1）')
+    parser.add_argument('--verbose', action='store_true',
+                       help='逐条执行建索引语句并输出每个索引的耗时')
+    parser.add_argument('--no-copy', action='store_true',
+                       help='不使用 COPY，改用 INSERT ... SELECT FROM unnest(...) 按列批量插入（表上有触发器等场景）')
+    parser.add_argument('--server-side', action='store_true',
+                       help='在 PostgreSQL 端用 generate_series 生成蓝票行（INSERT ... SELECT），省去客户端生成与传输')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='蓝票行生成进程数（默认: 1，大数据量可设为CPU核数）')
+    parser.add_argument('--unlogged', action='store_true',
+                       help='配合 --setup-db 使用：以 UNLOGGED 方式创建 blue_lines（不写WAL，崩溃后数据丢失）')
+    parser.add_argument('--defer-indexes', action='store_true',
+                       help='导入前删除 blue_lines 索引，导入完成后统一重建（适合大批量生成）')
 
     # 负数发票参数
     parser.add_argument('--scenario', choices=['small', 'mixed', 'stress', 'custom'],
@@ -1046,6 +1745,8 @@ def parse_args():
                        help='批次ID（用于断点续传和数据追踪）')
     parser.add_argument('--resume-from', type=int,
                        help='从指定位置继续生成（通常由系统自动检测）')
+    parser.add_argument('--verify-resume', action='store_true',
+                       help='续传前统计批次实际行数核对进度（大表上较慢）')
     parser.add_argument('--list-batches', action='store_true',
                        help='列出所有批次信息')
     parser.add_argument('--clear-batch', type=str,
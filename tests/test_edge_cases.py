@@ -26,24 +26,15 @@ from core.matching_engine import GreedyMatchingEngine, NegativeInvoice
 from core.db_manager import DatabaseManager, CandidateProvider
 from config.config import get_db_config
 from decimal import Decimal
+from psycopg2.extras import execute_values
+from collections import Counter
 import time
-import uuid
+import traceback
 
 def setup_edge_case_data(db_manager):
     """设置边界情况测试数据"""
     print("准备边界情况测试数据...")
 
-    # 清理之前的测试数据
-    conn = db_manager.pool.getconn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM blue_lines WHERE batch_id = 'test_edge'")
-            cur.execute("DELETE FROM match_records WHERE batch_id = 'test_edge'")
-            conn.commit()
-            print("✓ 清理旧数据完成")
-    finally:
-        db_manager.pool.putconn(conn)
-
     # 创建特殊测试数据
     test_data = []
 
@@ -128,19 +119,33 @@ def setup_edge_case_data(db_manager):
             'test_edge'  # batch_id
         ))
 
-    # 插入数据
+    # 清理旧数据并插入新数据（同一事务，只提交一次）
+    _run_setup(db_manager, test_data)
+
+def _run_setup(db_manager, test_data):
+    """在一个事务内清理旧的边界测试数据并批量插入新数据"""
     conn = db_manager.pool.getconn()
     try:
         with conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM blue_lines WHERE batch_id = %s;
+                DELETE FROM match_records WHERE batch_id LIKE %s
+            """, ('test_edge', 'test_edge_%'))
+            print("✓ 清理旧数据完成")
+
             insert_sql = """
                 INSERT INTO blue_lines (
                     ticket_id, tax_rate, buyer_id, seller_id,
                     product_name, original_amount, remaining, batch_id
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ) VALUES %s
             """
-            cur.executemany(insert_sql, test_data)
-            conn.commit()
-            print(f"✓ 插入 {len(test_data)} 条边界情况测试数据")
+            # 多行 VALUES 一次提交，替代 executemany 的逐行往返
+            execute_values(cur, insert_sql, test_data, page_size=1000)
+        conn.commit()
+        print(f"✓ 插入 {len(test_data)} 条边界情况测试数据")
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         db_manager.pool.putconn(conn)
 
@@ -185,6 +190,8 @@ def run_edge_cases_test():
     db_manager = DatabaseManager(db_config)
     engine = GreedyMatchingEngine(fragment_threshold=Decimal('5.0'))
     candidate_provider = CandidateProvider(db_manager)
+    # 批次ID在此生成，批量测试中途出错时清理也能按该批次删除已保存的匹配记录
+    batch_id = f"test_edge_{int(time.time())}"
 
     try:
         # 设置测试数据
@@ -198,27 +205,30 @@ def run_edge_cases_test():
         run_individual_tests(engine, candidate_provider, test_invoices)
 
         # 执行批量测试
-        run_batch_test(engine, candidate_provider, test_invoices, db_manager)
+        run_batch_test(engine, candidate_provider, test_invoices, db_manager, batch_id)
 
         print(f"\n✓ 边界情况测试完成")
         return True
 
     except Exception as e:
         print(f"\n❌ 测试失败: {e}")
-        import traceback
         traceback.print_exc()
         return False
     finally:
         # 清理数据
-        cleanup_edge_test_data(db_manager)
+        cleanup_edge_test_data(db_manager, batch_id)
 
 def run_individual_tests(engine, candidate_provider, test_invoices):
     """运行单个测试用例"""
-    print("=== 单个测试用例 ===")
+    # 输出先缓存，结束时一次写出，减少逐行 print 的写调用
+    lines = ["=== 单个测试用例 ==="]
+
+    # 相同 (税率, 买方, 卖方) 只查询一次数据库（CandidateProvider 内部缓存；match_single 不修改候选项）
+    candidate_provider.clear_cache()
 
     for i, invoice in enumerate(test_invoices):
-        print(f"\n测试 {i+1}: 负数发票 {invoice.invoice_id}")
-        print(f"  金额: {invoice.amount}, 税率: {invoice.tax_rate}%, "
+        lines.append(f"\n测试 {i+1}: 负数发票 {invoice.invoice_id}")
+        lines.append(f"  金额: {invoice.amount}, 税率: {invoice.tax_rate}%, "
               f"买方: {invoice.buyer_id}, 卖方: {invoice.seller_id}")
 
         # 获取候选项
@@ -227,11 +237,11 @@ def run_individual_tests(engine, candidate_provider, test_invoices):
             invoice.buyer_id,
             invoice.seller_id
         )
-        print(f"  找到候选项: {len(candidates)} 个")
+        lines.append(f"  找到候选项: {len(candidates)} 个")
 
         if candidates:
             total_available = sum(c.remaining for c in candidates)
-            print(f"  总可用余额: {total_available}")
+            lines.append(f"  总可用余额: {total_available}")
 
         # 执行匹配
         start_time = time.time()
@@ -240,48 +250,49 @@ def run_individual_tests(engine, candidate_provider, test_invoices):
 
         # 输出结果
         if result.success:
-            print(f"  ✓ 匹配成功 - 匹配金额: {result.total_matched}")
-            print(f"    使用 {len(result.allocations)} 个蓝票行")
+            lines.append(f"  ✓ 匹配成功 - 匹配金额: {result.total_matched}")
+            lines.append(f"    使用 {len(result.allocations)} 个蓝票行")
             if result.fragments_created > 0:
-                print(f"    ⚠️ 产生碎片: {result.fragments_created} 个")
+                lines.append(f"    ⚠️ 产生碎片: {result.fragments_created} 个")
         else:
-            print(f"  ✗ 匹配失败 - 原因: {result.failure_reason}")
+            lines.append(f"  ✗ 匹配失败 - 原因: {result.failure_reason}")
             if result.total_matched > 0:
-                print(f"    部分匹配: {result.total_matched}")
+                lines.append(f"    部分匹配: {result.total_matched}")
 
-        print(f"  耗时: {elapsed*1000:.2f}ms")
+        lines.append(f"  耗时: {elapsed*1000:.2f}ms")
 
         # 特殊情况验证
-        validate_special_cases(invoice, result, candidates)
+        validate_special_cases(invoice, result, candidates, lines)
+
+    print("\n".join(lines))
 
-def validate_special_cases(invoice, result, candidates):
-    """验证特殊情况"""
+def validate_special_cases(invoice, result, candidates, lines):
+    """验证特殊情况（结果追加到 lines）"""
     # 验证1：完全匹配的情况
     if invoice.invoice_id == 101:  # 完全匹配测试
         if result.success and result.total_matched == invoice.amount:
-            print("    ✓ 完全匹配验证通过")
+            lines.append("    ✓ 完全匹配验证通过")
         else:
-            print("    ⚠️ 完全匹配验证失败")
+            lines.append("    ⚠️ 完全匹配验证失败")
 
     # 验证2：无候选项的情况
     if invoice.buyer_id == 999 or invoice.seller_id == 999:
         if not result.success and result.failure_reason == "no_candidates":
-            print("    ✓ 无候选项验证通过")
+            lines.append("    ✓ 无候选项验证通过")
         else:
-            print("    ⚠️ 无候选项验证失败")
+            lines.append("    ⚠️ 无候选项验证失败")
 
     # 验证3：碎片阈值验证
     if invoice.invoice_id in [108, 109]:  # 碎片阈值测试
         if invoice.amount < Decimal('5.0'):
-            print(f"    碎片阈值测试: 金额 {invoice.amount} < 5.0")
+            lines.append(f"    碎片阈值测试: 金额 {invoice.amount} < 5.0")
         else:
-            print(f"    碎片阈值测试: 金额 {invoice.amount} >= 5.0")
+            lines.append(f"    碎片阈值测试: 金额 {invoice.amount} >= 5.0")
 
-def run_batch_test(engine, candidate_provider, test_invoices, db_manager):
-    """运行批量测试"""
+def run_batch_test(engine, candidate_provider, test_invoices, db_manager, batch_id):
+    """运行批量测试，匹配结果保存到 batch_id 批次"""
     print("\n=== 批量测试 ===")
 
-    batch_id = f"test_edge_{int(time.time())}"
     start_time = time.time()
 
     # 执行批量匹配
@@ -305,66 +316,75 @@ def run_batch_test(engine, candidate_provider, test_invoices, db_manager):
 
 def analyze_batch_results(invoices, results, elapsed):
     """分析批量结果"""
-    print("\n=== 批量结果分析 ===")
-
-    success_count = sum(1 for r in results if r.success)
-    total_requested = sum(inv.amount for inv in invoices)
-    total_matched = sum(r.total_matched for r in results)
-    fragment_count = sum(r.fragments_created for r in results)
-
-    print(f"总负数发票: {len(invoices)}")
-    print(f"匹配成功: {success_count} ({success_count/len(invoices)*100:.1f}%)")
-    print(f"匹配失败: {len(invoices) - success_count}")
-    print(f"总请求金额: {total_requested}")
-    print(f"总匹配金额: {total_matched}")
-    print(f"匹配覆盖率: {total_matched/total_requested*100:.1f}%")
-    print(f"产生碎片: {fragment_count} 个")
-    print(f"执行时间: {elapsed:.3f} 秒")
-    print(f"平均每单耗时: {elapsed/len(invoices)*1000:.2f} 毫秒")
+    lines = ["\n=== 批量结果分析 ==="]
 
-    # 失败原因统计
-    failure_reasons = {}
+    # 单次遍历累计成功数、匹配金额、碎片数和失败原因
+    success_count = total_matched = fragment_count = 0
+    failure_reasons = Counter()
     for result in results:
+        success_count += result.success
+        total_matched += result.total_matched
+        fragment_count += result.fragments_created
         if not result.success:
-            reason = result.failure_reason or "unknown"
-            failure_reasons[reason] = failure_reasons.get(reason, 0) + 1
+            failure_reasons[result.failure_reason or "unknown"] += 1
+    total_requested = sum(inv.amount for inv in invoices)
+
+    lines.append(f"总负数发票: {len(invoices)}")
+    lines.append(f"匹配成功: {success_count} ({success_count/len(invoices)*100:.1f}%)")
+    lines.append(f"匹配失败: {len(invoices) - success_count}")
+    lines.append(f"总请求金额: {total_requested}")
+    lines.append(f"总匹配金额: {total_matched}")
+    lines.append(f"匹配覆盖率: {total_matched/total_requested*100:.1f}%")
+    lines.append(f"产生碎片: {fragment_count} 个")
+    lines.append(f"执行时间: {elapsed:.3f} 秒")
+    lines.append(f"平均每单耗时: {elapsed/len(invoices)*1000:.2f} 毫秒")
 
+    # 失败原因统计
     if failure_reasons:
-        print("\n失败原因统计:")
+        lines.append("\n失败原因统计:")
         for reason, count in failure_reasons.items():
-            print(f"  {reason}: {count} 次")
+            lines.append(f"  {reason}: {count} 次")
 
     # 边界情况特殊验证
-    print("\n=== 边界情况验证 ===")
+    lines.append("\n=== 边界情况验证 ===")
 
     # 验证完全匹配
     exact_match_results = [r for i, r in enumerate(results) if invoices[i].invoice_id == 101]
     if exact_match_results and exact_match_results[0].success:
-        print("✓ 完全匹配场景验证通过")
+        lines.append("✓ 完全匹配场景验证通过")
     else:
-        print("⚠️ 完全匹配场景验证失败")
+        lines.append("⚠️ 完全匹配场景验证失败")
 
     # 验证无候选项场景
     no_candidate_results = [r for i, r in enumerate(results)
                            if invoices[i].buyer_id == 999 or invoices[i].seller_id == 999]
     if no_candidate_results and not no_candidate_results[0].success:
-        print("✓ 无候选项场景验证通过")
+        lines.append("✓ 无候选项场景验证通过")
     else:
-        print("⚠️ 无候选项场景验证失败")
+        lines.append("⚠️ 无候选项场景验证失败")
 
     # 验证碎片控制
     fragment_results = [r for r in results if r.fragments_created > 0]
-    print(f"✓ 碎片控制: {len(fragment_results)} 个匹配产生了碎片")
+    lines.append(f"✓ 碎片控制: {len(fragment_results)} 个匹配产生了碎片")
+
+    print("\n".join(lines))
+
+def cleanup_edge_test_data(db_manager, batch_id):
+    """
+    清理边界测试数据
 
-def cleanup_edge_test_data(db_manager):
-    """清理边界测试数据"""
+    Args:
+        batch_id: 本次批量测试的批次ID；按等值条件删除匹配记录（走 idx_match_batch 索引）
+    """
     print("\n清理边界测试数据...")
 
     conn = db_manager.pool.getconn()
     try:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM match_records WHERE batch_id LIKE 'test_edge_%'")
-            cur.execute("DELETE FROM blue_lines WHERE batch_id = 'test_edge'")
+            cur.execute("""
+                DELETE FROM match_records WHERE batch_id = %s;
+                DELETE FROM blue_lines WHERE batch_id = %s
+            """, (batch_id, 'test_edge'))
             conn.commit()
             print("✓ 边界测试数据清理完成")
     finally:
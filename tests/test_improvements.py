@@ -22,67 +22,94 @@ from core.db_manager import DatabaseManager, CandidateProvider
 from core.monitoring import get_monitor
 from config.config import get_db_config
 from decimal import Decimal
+from psycopg2.extras import execute_values
+import io
 import time
-import random
+import traceback
+import numpy as np
+
+# 达到该行数时改用 COPY 导入测试数据（多行 INSERT 在约 1000 行/批后收益已饱和）
+COPY_THRESHOLD = 5000
 
 def create_diverse_test_data(db_manager, count=1000):
-    """创建多样化的测试数据"""
-    print(f"创建 {count} 条多样化测试数据...")
+    """
+    创建多样化的测试数据
 
-    # 清理之前的测试数据
-    conn = db_manager.pool.getconn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM blue_lines WHERE batch_id = 'test_improvements'")
-            cur.execute("DELETE FROM match_records WHERE batch_id LIKE 'test_improvements_%'")
-            conn.commit()
-    finally:
-        db_manager.pool.putconn(conn)
+    Returns:
+        int: 入库后按 batch_id 实际统计到的行数
+    """
+    print(f"创建 {count} 条多样化测试数据...")
 
     # 创建多种组合的测试数据
-    test_data = []
-    combinations = [
+    combinations = np.array([
         (13, 1, 1),  # 税率13%, 买方1, 卖方1
         (13, 1, 2),  # 税率13%, 买方1, 卖方2
         (6, 2, 1),   # 税率6%, 买方2, 卖方1
         (6, 2, 2),   # 税率6%, 买方2, 卖方2
         (3, 3, 3),   # 税率3%, 买方3, 卖方3
-    ]
-
-    for i in range(count):
-        # 随机选择组合
-        tax_rate, buyer_id, seller_id = random.choice(combinations)
-
-        test_data.append((
-            i + 1,  # ticket_id
-            tax_rate,
-            buyer_id,
-            seller_id,
-            f"Product_{i}",
-            Decimal('500.00'),  # original_amount
-            Decimal(str(10 + random.randint(1, 200))),  # remaining
-            'test_improvements'
-        ))
-
-    # 插入数据
+    ])
+
+    # 整列一次抽样：随机组合 + remaining 11-210（数值类型由数据库入库时转换）
+    rng = np.random.default_rng()
+    combos = combinations[rng.integers(0, len(combinations), size=count)]
+    remaining = rng.integers(11, 211, size=count)
+
+    test_data = list(zip(
+        range(1, count + 1),  # ticket_id
+        combos[:, 0].tolist(),
+        combos[:, 1].tolist(),
+        combos[:, 2].tolist(),
+        [f"Product_{i}" for i in range(count)],
+        [500.00] * count,  # original_amount
+        remaining.tolist(),
+        ['test_improvements'] * count
+    ))
+
+    # 清理旧数据并插入新数据（同一事务，只提交一次）
     conn = db_manager.pool.getconn()
     try:
         with conn.cursor() as cur:
-            insert_sql = """
-                INSERT INTO blue_lines (
-                    ticket_id, tax_rate, buyer_id, seller_id,
-                    product_name, original_amount, remaining, batch_id
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cur.executemany(insert_sql, test_data)
-            conn.commit()
-            print(f"✓ 成功插入 {len(test_data)} 条测试数据")
+            cur.execute("""
+                DELETE FROM blue_lines WHERE batch_id = %s;
+                DELETE FROM match_records WHERE batch_id LIKE %s
+            """, ('test_improvements', 'test_improvements_%'))
+
+            if len(test_data) >= COPY_THRESHOLD:
+                # 大数据量：拼成制表符分隔文本（各列均非空），COPY 一次导入
+                buf = io.StringIO()
+                for row in test_data:
+                    buf.write('\t'.join(map(str, row)))
+                    buf.write('\n')
+                buf.seek(0)
+                cur.copy_expert("""
+                    COPY blue_lines (
+                        ticket_id, tax_rate, buyer_id, seller_id,
+                        product_name, original_amount, remaining, batch_id
+                    ) FROM STDIN WITH (FORMAT text)
+                """, buf)
+            else:
+                insert_sql = """
+                    INSERT INTO blue_lines (
+                        ticket_id, tax_rate, buyer_id, seller_id,
+                        product_name, original_amount, remaining, batch_id
+                    ) VALUES %s
+                """
+                # 多行 VALUES 一次提交，替代 executemany 的逐行往返
+                execute_values(cur, insert_sql, test_data, page_size=1000)
+
+            cur.execute("SELECT COUNT(*) FROM blue_lines WHERE batch_id = %s", ('test_improvements',))
+            inserted = cur.fetchone()[0]
+        conn.commit()
+        print(f"✓ 成功插入 {inserted} 条测试数据")
+        return inserted
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         db_manager.pool.putconn(conn)
 
 def create_diverse_negative_invoices(count=100):
     """创建多样化的负数发票"""
-    invoices = []
     combinations = [
         (13, 1, 1),
         (13, 1, 2),
@@ -91,28 +118,26 @@ def create_diverse_negative_invoices(count=100):
         (3, 3, 3),
     ]
 
-    for i in range(count):
-        tax_rate, buyer_id, seller_id = random.choice(combinations)
-        amount = Decimal(str(random.randint(50, 500)))
+    # 组合索引与金额（50-500 整数元）一次抽样；整数金额直接 Decimal(int)，无需经字符串转换
+    rng = np.random.default_rng()
+    combo_idx = rng.integers(0, len(combinations), size=count).tolist()
+    amounts = rng.integers(50, 501, size=count).tolist()
 
-        invoices.append(NegativeInvoice(
+    return [
+        NegativeInvoice(
             invoice_id=i + 1,
-            amount=amount,
-            tax_rate=tax_rate,
-            buyer_id=buyer_id,
-            seller_id=seller_id
-        ))
-
-    return invoices
+            amount=Decimal(amount),
+            tax_rate=combinations[c][0],
+            buyer_id=combinations[c][1],
+            seller_id=combinations[c][2]
+        )
+        for i, (c, amount) in enumerate(zip(combo_idx, amounts))
+    ]
 
-def test_grouping_optimization():
+def test_grouping_optimization(db_manager, engine, candidate_provider):
     """测试分组优化功能"""
     print("\n=== 测试分组优化 ===")
 
-    db_config = get_db_config('test')
-    db_manager = DatabaseManager(db_config)
-    engine = GreedyMatchingEngine()
-
     # 创建测试数据
     create_diverse_test_data(db_manager, 500)
 
@@ -128,9 +153,6 @@ def test_grouping_optimization():
     print(f"总组合数: {len(combo_count)}, 总发票数: {len(negatives)}")
     print(f"分组优化预期减少查询: {len(negatives) - len(combo_count)} 次")
 
-    # 创建候选提供器
-    candidate_provider = CandidateProvider(db_manager)
-
     # 执行匹配
     start_time = time.time()
     results = engine.match_batch(negatives, candidate_provider)
@@ -145,7 +167,7 @@ def test_grouping_optimization():
 
     return True
 
-def test_monitoring_system():
+def test_monitoring_system(db_manager, engine, candidate_provider):
     """测试监控系统"""
     print("\n=== 测试监控系统 ===")
 
@@ -153,17 +175,11 @@ def test_monitoring_system():
     monitor = get_monitor()
     monitor.reset_stats()
 
-    db_config = get_db_config('test')
-    db_manager = DatabaseManager(db_config)
-    engine = GreedyMatchingEngine()
-    candidate_provider = CandidateProvider(db_manager)
-
     # 执行几轮匹配以产生监控数据
     for round_num in range(3):
         negatives = create_diverse_negative_invoices(20)
         results = engine.match_batch(negatives, candidate_provider)
         print(f"第 {round_num + 1} 轮匹配完成")
-        time.sleep(0.1)  # 模拟间隔
 
     # 获取健康报告
     health_report = monitor.get_health_report()
@@ -205,15 +221,10 @@ def test_monitoring_system():
 
     return True
 
-def test_smart_routing():
+def test_smart_routing(db_manager, engine, candidate_provider):
     """测试智能路由功能"""
     print("\n=== 测试智能路由 ===")
 
-    db_config = get_db_config('test')
-    db_manager = DatabaseManager(db_config)
-    engine = GreedyMatchingEngine()
-    candidate_provider = CandidateProvider(db_manager)
-
     # 测试不同规模的批次
     test_cases = [
         ("小批量", 50),      # < 1000，应使用标准处理
@@ -222,15 +233,16 @@ def test_smart_routing():
     ]
 
     for case_name, batch_size in test_cases:
-        print(f"\n--- {case_name}测试 ({batch_size} 条) ---")
+        # 每个用例的输出缓存后一次写出
+        lines = [f"\n--- {case_name}测试 ({batch_size} 条) ---"]
 
         # 创建测试数据
         negatives = create_diverse_negative_invoices(batch_size)
 
         # 获取处理建议
         recommendation = engine.get_processing_recommendation(batch_size)
-        print(f"系统建议: {recommendation['reason']}")
-        print(f"预期内存: {recommendation['expected_memory']}")
+        lines.append(f"系统建议: {recommendation['reason']}")
+        lines.append(f"预期内存: {recommendation['expected_memory']}")
 
         # 执行匹配（用户无感知的智能路由）
         start_time = time.time()
@@ -239,22 +251,72 @@ def test_smart_routing():
 
         success_count = sum(1 for r in results if r.success)
 
-        print(f"执行结果:")
-        print(f"  成功匹配: {success_count}/{batch_size} ({success_count/batch_size*100:.1f}%)")
-        print(f"  总耗时: {elapsed:.3f}s")
-        print(f"  平均响应: {elapsed/batch_size*1000:.2f}ms/条")
+        lines.append(f"执行结果:")
+        lines.append(f"  成功匹配: {success_count}/{batch_size} ({success_count/batch_size*100:.1f}%)")
+        lines.append(f"  总耗时: {elapsed:.3f}s")
+        lines.append(f"  平均响应: {elapsed/batch_size*1000:.2f}ms/条")
+        print("\n".join(lines))
+
+    return True
+
+def test_smart_routing_sql(db_manager, engine, candidate_provider):
+    """对比Python引擎与数据库内集合式匹配（大批量场景）"""
+    print("\n=== 测试数据库内匹配 ===")
 
+    batch_size = 15000
+
+    # 供给与需求同规模：15000 行达到 COPY_THRESHOLD，走 COPY 导入路径
+    inserted = create_diverse_test_data(db_manager, batch_size)
+    if inserted != batch_size:
+        print(f"❌ COPY 导入行数不符: {inserted}/{batch_size}")
+        return False
+
+    negatives = create_diverse_negative_invoices(batch_size)
+
+    # Python引擎：每组取完整候选集后一次组内匹配，余额在组内发票之间延续，与SQL递归推进一致。
+    # 不走 match_batch：大批量时流式处理的每个切片都面对未扣减的完整供给，两者不可比。
+    # 直接查询数据库而不用候选缓存，避免读到重建测试数据之前的缓存
+    start_time = time.time()
+    results = [None] * batch_size
+    for (tax_rate, buyer_id, seller_id), group_negatives in engine._group_negatives_by_conditions(negatives).items():
+        candidates = db_manager.get_candidates(tax_rate, buyer_id, seller_id)
+        for original_index, result in engine._match_group(group_negatives, candidates, "amount_desc").items():
+            results[original_index] = result
+    python_elapsed = time.time() - start_time
+    python_success = sum(1 for r in results if r.success)
+
+    # 数据库内匹配（执行更新和写入后回滚，不留下余额变更与匹配记录）
+    batch_id = f"test_improvements_sql_{int(time.time())}"
+    start_time = time.time()
+    sql_results = db_manager.match_batch_sql(negatives, batch_id, commit=False)
+    sql_elapsed = time.time() - start_time
+    sql_success = sum(1 for r in sql_results if r.success)
+
+    print(f"对比结果 ({batch_size} 条):")
+    print(f"  Python引擎: 成功 {python_success}/{batch_size}, 耗时 {python_elapsed:.3f}s")
+    print(f"  数据库匹配: 成功 {sql_success}/{batch_size}, 耗时 {sql_elapsed:.3f}s (含写入，已回滚)")
+    if sql_elapsed > 0:
+        print(f"  加速比: {python_elapsed/sql_elapsed:.1f}x")
+
+    # 金额均为整数元，两条路径必须逐张一致：成功标志相同，成功时匹配总额相同
+    mismatches = [
+        (py.negative_invoice_id, py.success, sql.success, py.total_matched, sql.total_matched)
+        for py, sql in zip(results, sql_results)
+        if py.success != sql.success or (py.success and py.total_matched != sql.total_matched)
+    ]
+    if mismatches:
+        print(f"❌ 逐张对比不一致: {len(mismatches)}/{batch_size}")
+        for invoice_id, py_success, sql_success, py_matched, sql_matched in mismatches[:5]:
+            print(f"  发票 {invoice_id}: Python {py_success}/{py_matched}, SQL {sql_success}/{sql_matched}")
+        return False
+
+    print(f"✓ 逐张对比一致: {batch_size}/{batch_size}")
     return True
 
-def test_batch_update_optimization():
+def test_batch_update_optimization(db_manager, engine, candidate_provider):
     """测试批量更新优化"""
     print("\n=== 测试批量更新优化 ===")
 
-    db_config = get_db_config('test')
-    db_manager = DatabaseManager(db_config)
-    engine = GreedyMatchingEngine()
-    candidate_provider = CandidateProvider(db_manager)
-
     # 创建一些负数发票
     negatives = create_diverse_negative_invoices(10)
 
@@ -264,13 +326,16 @@ def test_batch_update_optimization():
     match_time = time.time() - start_time
 
     # 保存结果（测试批量更新）
-    batch_id = f"test_improvements_{int(time.time())}"
+    batch_id = f"test_improvements_update_{int(time.time())}"
     save_start = time.time()
     save_success = db_manager.save_match_results(results, batch_id)
     save_time = time.time() - save_start
 
-    success_count = sum(1 for r in results if r.success)
-    total_allocations = sum(len(r.allocations) for r in results if r.success)
+    success_count = total_allocations = 0
+    for r in results:
+        if r.success:
+            success_count += 1
+            total_allocations += len(r.allocations)
 
     print(f"批量更新测试结果:")
     print(f"  匹配时间: {match_time:.3f}s")
@@ -282,18 +347,49 @@ def test_batch_update_optimization():
 
     return save_success
 
+def create_fixtures():
+    """
+    创建各测试共用的数据库管理器、匹配引擎和候选提供器，并预热连接池
+
+    预热让连接建立开销不计入第一次 match_batch 的耗时
+    """
+    db_manager = DatabaseManager(get_db_config('test'))
+    engine = GreedyMatchingEngine()
+    candidate_provider = CandidateProvider(db_manager)
+
+    conns = [db_manager.pool.getconn() for _ in range(db_manager.pool.minconn)]
+    try:
+        for conn in conns:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+    finally:
+        for conn in conns:
+            db_manager.pool.putconn(conn)
+
+    return db_manager, engine, candidate_provider
+
 def main():
     """主测试函数"""
     print("=== 负数发票匹配系统改进功能测试 ===\n")
 
+    fixtures = None
     try:
+        fixtures = create_fixtures()
+
         # 测试各项改进功能
-        test_results = {
-            'grouping_optimization': test_grouping_optimization(),
-            'monitoring_system': test_monitoring_system(),
-            'smart_routing': test_smart_routing(),
-            'batch_update_optimization': test_batch_update_optimization(),
-        }
+        test_results = {}
+
+        # 分组测试负责准备测试数据，必须最先执行；监控测试会重置全局监控统计，需独占执行
+        test_results['grouping_optimization'] = test_grouping_optimization(*fixtures)
+        test_results['monitoring_system'] = test_monitoring_system(*fixtures)
+
+        # 批量更新会扣减智能路由所读的同一批余额，两者串行执行，结果可复现
+        test_results['smart_routing'] = test_smart_routing(*fixtures)
+        test_results['batch_update_optimization'] = test_batch_update_optimization(*fixtures)
+
+        # 数据库内匹配在事务内大量修改余额（结束时回滚），放在最后串行执行
+        test_results['smart_routing_sql'] = test_smart_routing_sql(*fixtures)
 
         # 汇总测试结果
         print(f"\n=== 测试结果汇总 ===")
@@ -309,7 +405,11 @@ def main():
 
     except Exception as e:
         print(f"\n❌ 测试过程中发生错误: {e}")
+        sys.stderr.write(traceback.format_exc())
         return False
+    finally:
+        if fixtures:
+            fixtures[0].close()
 
 if __name__ == "__main__":
     success = main()
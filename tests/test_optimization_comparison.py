@@ -12,19 +12,56 @@
 
 import sys
 import os
+import argparse
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict
+from decimal import Decimal
+from dataclasses import dataclass
+from typing import List, Dict, Optional
 
 # 添加项目根目录到路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from core.matching_engine import GreedyMatchingEngine, NegativeInvoice
+from core.matching_engine import GreedyMatchingEngine, NegativeInvoice, results_to_ndarray
 from core.db_manager import DatabaseManager, CandidateProvider
+from core.matching_numba import NUMBA_AVAILABLE, candidates_to_arrays, match_single_cents
 from core.performance_monitor import get_performance_timer, reset_performance_timer
 from config.config import get_db_config
 from tests.test_data_generator import TestDataGenerator
-import psycopg2
+# 可选：psycopg 3 管道模式（批量发送 EXPLAIN，减少网络往返）
+try:
+    import psycopg
+    PSYCOPG3_AVAILABLE = True
+except ImportError:
+    PSYCOPG3_AVAILABLE = False
+
+CANDIDATES_SQL = """
+    SELECT line_id, remaining, tax_rate, buyer_id, seller_id
+    FROM blue_lines
+    WHERE tax_rate = %s
+      AND buyer_id = %s
+      AND seller_id = %s
+      AND remaining > 0
+    ORDER BY remaining ASC
+    LIMIT 10000
+"""
+
+EXPLAIN_CANDIDATES_SQL = "EXPLAIN (ANALYZE, BUFFERS)" + CANDIDATES_SQL
+
+# 文本格式执行计划解析：根节点实际耗时、扫描节点类型（预编译，重复使用）
+ACTUAL_TIME_RE = re.compile(r'actual time=[\d.]+\.\.([\d.]+)')
+SCAN_NODE_RE = re.compile(r'(Index Only Scan|Index Scan|Bitmap Heap Scan|Bitmap Index Scan|Seq Scan)')
+
+
+@dataclass
+class PerfSnapshot:
+    """一次性能对比中的一组指标（优化前基准 / 优化后当前）"""
+    query_time_ms: float
+    success_rate: float
+    total_time_seconds: float = 0.0
+    p99_response_ms: Optional[float] = None
 
 
 class OptimizationComparison:
@@ -37,12 +74,16 @@ class OptimizationComparison:
         self.candidate_provider = CandidateProvider(self.db_manager)
         self.data_generator = TestDataGenerator(self.db_config)
 
+        # 各子测试结果缓存：每个测试在一次运行中只执行一次
+        self._query_results = None
+        self._matching_results = None
+
     def test_database_query_performance(self):
-        """测试数据库查询性能"""
-        print("=== 数据库查询性能测试 ===")
+        """测试数据库查询性能（结果缓存，重复调用直接返回）"""
+        if self._query_results is not None:
+            return self._query_results
 
-        conn = psycopg2.connect(**self.db_config)
-        cur = conn.cursor()
+        print("=== 数据库查询性能测试 ===")
 
         # 测试场景：查询热门组合
         test_cases = [
@@ -52,61 +93,111 @@ class OptimizationComparison:
             (3, 50, 50), # 长尾组合
         ]
 
-        results = []
+        # 各组合相互独立且耗时主要在服务端，每个组合借用一个连接池连接并发执行，
+        # ex.map 保持结果与 test_cases 顺序一致
+        with ThreadPoolExecutor(max_workers=len(test_cases)) as ex:
+            case_results = list(ex.map(self._run_query_case, test_cases))
 
-        for tax_rate, buyer_id, seller_id in test_cases:
+        # psycopg 3 可用时执行计划通过管道模式批量获取，否则已在各线程内获取
+        if PSYCOPG3_AVAILABLE:
+            plans = self._explain_candidate_queries(test_cases)
+        else:
+            plans = [plan for _, _, plan in case_results]
+
+        results = []
+        for (tax_rate, buyer_id, seller_id), (execution_time, row_count, _), plan in zip(test_cases, case_results, plans):
             print(f"\\n测试组合: 税率{tax_rate}%, 买方{buyer_id}, 卖方{seller_id}")
 
-            # 执行查询并记录时间
-            start_time = time.time()
-            cur.execute("""
-                EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
-                SELECT line_id, remaining, tax_rate, buyer_id, seller_id
-                FROM blue_lines
-                WHERE tax_rate = %s
-                  AND buyer_id = %s
-                  AND seller_id = %s
-                  AND remaining > 0
-                ORDER BY remaining ASC
-                LIMIT 10000
-            """, (tax_rate, buyer_id, seller_id))
-
-            explain_result = cur.fetchone()[0][0]
-            execution_time = time.time() - start_time
-
-            # 解析执行计划
-            plan = explain_result['Plan']
-            actual_time = plan['Actual Total Time']
-            index_used = 'Index Scan' in plan.get('Node Type', '')
-
-            print(f"  执行时间: {actual_time:.2f}ms")
-            print(f"  使用索引: {'是' if index_used else '否'}")
-            print(f"  扫描方式: {plan.get('Node Type', '未知')}")
+            # 解析执行计划：根节点实际耗时，任一节点含 Index Scan 即视为走索引，扫描方式取第一个扫描节点
+            plan_summary = self._summarize_plan(plan)
+
+            print(f"  执行时间: {execution_time:.2f}ms (返回 {row_count} 行)")
+            print(f"  计划内耗时: {plan_summary['plan_time_ms']:.2f}ms")
+            print(f"  使用索引: {'是' if plan_summary['index_used'] else '否'}")
+            print(f"  扫描方式: {plan_summary['scan_type']}")
 
             results.append({
                 'combination': f"{tax_rate}_{buyer_id}_{seller_id}",
-                'execution_time_ms': actual_time,
-                'index_used': index_used,
-                'scan_type': plan.get('Node Type', '未知')
+                'execution_time_ms': execution_time,
+                **plan_summary
             })
 
-        cur.close()
-        conn.close()
-
         # 输出汇总
         print(f"\\n=== 查询性能汇总 ===")
         total_queries = len(results)
         index_queries = sum(1 for r in results if r['index_used'])
         avg_time = sum(r['execution_time_ms'] for r in results) / len(results)
+        avg_plan_time = sum(r['plan_time_ms'] for r in results) / len(results)
 
         print(f"总查询数: {total_queries}")
         print(f"使用索引: {index_queries}/{total_queries} ({index_queries/total_queries:.1%})")
-        print(f"平均查询时间: {avg_time:.2f}ms")
+        print(f"平均查询时间: {avg_time:.2f}ms (客户端，含传输)")
+        print(f"平均计划内耗时: {avg_plan_time:.2f}ms (服务端)")
 
+        self._query_results = results
         return results
 
+    @staticmethod
+    def _summarize_plan(plan: str) -> Dict:
+        """从文本格式执行计划提取根节点耗时、是否有节点走索引（Index Scan / Index Only Scan）和第一个扫描节点的类型"""
+        time_match = ACTUAL_TIME_RE.search(plan)
+        scan_match = SCAN_NODE_RE.search(plan)
+        return {
+            'plan_time_ms': float(time_match.group(1)) if time_match else 0.0,
+            'index_used': 'Index Scan' in plan or 'Index Only Scan' in plan,
+            'scan_type': scan_match.group(1) if scan_match else '未知'
+        }
+
+    def _run_query_case(self, case: tuple) -> tuple:
+        """
+        在独立的连接池连接上执行单个组合的候选查询
+
+        查询先正常执行一次计时（客户端墙钟，含结果传输），再在 EXPLAIN ANALYZE 下执行第二次，
+        取服务端计划内耗时（plan_time_ms）与优化前的基准对比；两次执行是有意的，耗时分别统计
+
+        Returns:
+            (执行耗时ms, 返回行数, 执行计划)；psycopg 3 可用时执行计划为 None，改由管道模式统一获取
+        """
+        conn = self.db_manager.pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                # 计时只包含真实查询（执行 + 取回结果），不含 EXPLAIN 的统计开销
+                start_time = time.perf_counter_ns()
+                cur.execute(CANDIDATES_SQL, case)
+                rows = cur.fetchall()
+                execution_time = (time.perf_counter_ns() - start_time) / 1e6
+
+                plan = None
+                if not PSYCOPG3_AVAILABLE:
+                    cur.execute(EXPLAIN_CANDIDATES_SQL, case)
+                    plan = '\n'.join(row[0] for row in cur.fetchall())
+            return execution_time, len(rows), plan
+        finally:
+            conn.rollback()
+            self.db_manager.pool.putconn(conn)
+
+    def _explain_candidate_queries(self, test_cases: List[tuple]) -> List[str]:
+        """
+        使用 psycopg 3 管道模式获取各查询组合的执行计划（EXPLAIN ANALYZE）
+
+        所有 EXPLAIN 连续发送、一次同步，N 个组合只需约一次网络往返
+        """
+        conninfo = {k: v for k, v in self.db_config.items() if k != 'database'}
+        conninfo['dbname'] = self.db_config['database']
+        with psycopg.connect(**conninfo) as pipe_conn:
+            with pipe_conn.pipeline():
+                cursors = []
+                for case in test_cases:
+                    pipe_cur = pipe_conn.cursor()
+                    pipe_cur.execute(EXPLAIN_CANDIDATES_SQL, case)
+                    cursors.append(pipe_cur)
+            return ['\n'.join(row[0] for row in pipe_cur.fetchall()) for pipe_cur in cursors]
+
     def test_matching_performance_with_monitoring(self):
-        """测试匹配性能（带详细监控）"""
+        """测试匹配性能（带详细监控，结果缓存，重复调用直接返回）"""
+        if self._matching_results is not None:
+            return self._matching_results
+
         print("\\n=== 匹配性能测试（详细监控） ===")
 
         # 重置性能计时器
@@ -121,7 +212,7 @@ class OptimizationComparison:
         print(f"生成 {len(negatives)} 个测试负数发票")
 
         # 执行匹配测试
-        start_time = time.time()
+        start_time = time.perf_counter_ns()
 
         with timer.measure("total_matching_process"):
             results = self.engine.match_batch(
@@ -131,13 +222,17 @@ class OptimizationComparison:
                 enable_monitoring=True
             )
 
-        total_time = time.time() - start_time
+        total_time = (time.perf_counter_ns() - start_time) / 1e9
+
+        # 与整数分贪婪内核对比（不计入上面的匹配耗时）
+        numba_comparison = self.test_numba_matcher_consistency(negatives)
 
         # 分析结果
-        success_count = sum(1 for r in results if r.success)
+        arr = results_to_ndarray(results)
+        success_count = int(arr['success'].sum())
         success_rate = success_count / len(results)
-        total_matched = sum(r.total_matched for r in results)
-        fragments = sum(r.fragments_created for r in results)
+        total_matched = Decimal(int(arr['matched'].sum())).scaleb(-2)
+        fragments = int(arr['fragments'].sum())
 
         print(f"\\n匹配结果:")
         print(f"  成功匹配: {success_count}/{len(results)} ({success_rate:.1%})")
@@ -152,7 +247,7 @@ class OptimizationComparison:
         # 生成性能报告
         performance_report = timer.get_performance_report(self.db_manager)
 
-        return {
+        self._matching_results = {
             'matching_results': {
                 'total_invoices': len(results),
                 'success_count': success_count,
@@ -161,39 +256,101 @@ class OptimizationComparison:
                 'fragments_created': fragments,
                 'total_time_seconds': total_time
             },
-            'performance_report': performance_report
+            'performance_report': performance_report,
+            'numba_comparison': numba_comparison
+        }
+        return self._matching_results
+
+    def test_numba_matcher_consistency(self, negatives: List[NegativeInvoice]) -> Dict:
+        """
+        对比 Decimal 版 match_single 与整数分数组版贪婪内核：逐单校验结果一致并比较耗时
+
+        每张负数发票都使用其组内的原始候选集（互不扣减），两种实现输入完全相同
+        """
+        print(f"\\n=== 整数分贪婪内核对比 ({'numba' if NUMBA_AVAILABLE else '纯Python'}) ===")
+
+        conditions = list({(n.tax_rate, n.buyer_id, n.seller_id) for n in negatives})
+        group_candidates = self.db_manager.get_candidates_batch(conditions)
+        group_arrays = {key: candidates_to_arrays(cands) for key, cands in group_candidates.items()}
+
+        start_time = time.perf_counter_ns()
+        decimal_results = [
+            self.engine.match_single(n, group_candidates[(n.tax_rate, n.buyer_id, n.seller_id)])
+            for n in negatives
+        ]
+        decimal_time = (time.perf_counter_ns() - start_time) / 1e9
+
+        # 预热一次，JIT 编译时间不计入对比
+        if negatives:
+            first = negatives[0]
+            match_single_cents(first, *group_arrays[(first.tax_rate, first.buyer_id, first.seller_id)])
+
+        start_time = time.perf_counter_ns()
+        cents_results = [
+            match_single_cents(n, *group_arrays[(n.tax_rate, n.buyer_id, n.seller_id)])
+            for n in negatives
+        ]
+        cents_time = (time.perf_counter_ns() - start_time) / 1e9
+
+        mismatches = [
+            d.negative_invoice_id
+            for d, c in zip(decimal_results, cents_results)
+            if (d.success, d.total_matched, d.fragments_created,
+                [(a.blue_line_id, a.amount_used) for a in d.allocations])
+            != (c.success, c.total_matched, c.fragments_created,
+                [(a.blue_line_id, a.amount_used) for a in c.allocations])
+        ]
+
+        print(f"  Decimal 版: {decimal_time*1000:.2f}ms")
+        print(f"  整数分版: {cents_time*1000:.2f}ms")
+        print(f"  结果一致: {'是' if not mismatches else f'否（{len(mismatches)} 单不一致: {mismatches[:10]}）'}")
+
+        return {
+            'decimal_time_seconds': decimal_time,
+            'cents_time_seconds': cents_time,
+            'mismatches': mismatches
         }
 
-    def compare_with_baseline(self):
-        """与基准性能对比"""
+    def compare_with_baseline(self, query_results: List[Dict] = None, matching_results: Dict = None):
+        """
+        与基准性能对比
+
+        Args:
+            query_results: 已有的查询性能测试结果（传入则直接复用，不再重跑）
+            matching_results: 已有的匹配性能测试结果（同上）
+        """
         print("\\n=== 性能对比 ===")
 
         # 基准数据（优化前的预期性能）
-        baseline = {
-            'query_time_ms': 1250,  # 之前测试的全表扫描时间
-            'p99_response_ms': 11000,  # 之前的P99响应时间
-            'success_rate': 0.70,  # 之前的匹配率
-        }
+        baseline = PerfSnapshot(
+            query_time_ms=1250,  # 之前测试的全表扫描时间（服务端 EXPLAIN ANALYZE 耗时）
+            success_rate=0.70,  # 之前的匹配率
+            p99_response_ms=11000,  # 之前的P99响应时间
+        )
 
         # 当前性能（优化后）
-        query_results = self.test_database_query_performance()
-        matching_results = self.test_matching_performance_with_monitoring()
-
-        current = {
-            'query_time_ms': sum(r['execution_time_ms'] for r in query_results) / len(query_results),
-            'success_rate': matching_results['matching_results']['success_rate'],
-            'total_time_seconds': matching_results['matching_results']['total_time_seconds']
-        }
+        # 子测试各自缓存结果，已运行过则直接复用
+        if query_results is None:
+            query_results = self.test_database_query_performance()
+        if matching_results is None:
+            matching_results = self.test_matching_performance_with_monitoring()
+
+        # 基准是服务端耗时，当前值同样取 EXPLAIN ANALYZE 的计划内耗时，不含客户端传输
+        current = PerfSnapshot(
+            query_time_ms=sum(r['plan_time_ms'] for r in query_results) / len(query_results),
+            success_rate=matching_results['matching_results']['success_rate'],
+            total_time_seconds=matching_results['matching_results']['total_time_seconds']
+        )
 
         # 计算改进幅度
-        query_improvement = baseline['query_time_ms'] / current['query_time_ms']
-        success_improvement = current['success_rate'] / baseline['success_rate']
+        query_improvement = baseline.query_time_ms / max(current.query_time_ms, 0.001)
+        success_improvement = current.success_rate / baseline.success_rate
 
         print(f"\\n📊 性能改进对比:")
         print(f"{'指标':<20} {'优化前':<15} {'优化后':<15} {'改进幅度':<15}")
         print("-" * 70)
-        print(f"{'平均查询时间':<20} {baseline['query_time_ms']:<15.1f} {current['query_time_ms']:<15.1f} {query_improvement:<15.1f}x")
-        print(f"{'匹配成功率':<20} {baseline['success_rate']:<15.1%} {current['success_rate']:<15.1%} {success_improvement:<15.1f}x")
+        print(f"{'平均查询时间(服务端)':<20} {baseline.query_time_ms:<15.1f} {current.query_time_ms:<15.1f} {query_improvement:<15.1f}x")
+        print(f"{'匹配成功率':<20} {baseline.success_rate:<15.1%} {current.success_rate:<15.1%} {success_improvement:<15.1f}x")
 
         # 结论
         print(f"\\n🎯 优化效果:")
@@ -204,12 +361,12 @@ class OptimizationComparison:
         else:
             print(f"  ⚠️ 查询性能提升有限: {query_improvement:.1f}倍")
 
-        if current['success_rate'] > 0.93:
-            print(f"  ✅ 匹配率达到目标: {current['success_rate']:.1%} > 93%")
-        elif current['success_rate'] > baseline['success_rate']:
-            print(f"  ✅ 匹配率有所提升: {current['success_rate']:.1%}")
+        if current.success_rate > 0.93:
+            print(f"  ✅ 匹配率达到目标: {current.success_rate:.1%} > 93%")
+        elif current.success_rate > baseline.success_rate:
+            print(f"  ✅ 匹配率有所提升: {current.success_rate:.1%}")
         else:
-            print(f"  ⚠️ 匹配率需要进一步优化: {current['success_rate']:.1%}")
+            print(f"  ⚠️ 匹配率需要进一步优化: {current.success_rate:.1%}")
 
         return {
             'baseline': baseline,
@@ -220,12 +377,23 @@ class OptimizationComparison:
             }
         }
 
-    def generate_optimization_report(self):
-        """生成优化报告"""
+    def run_all(self) -> Dict:
+        """依次运行各子测试（每个只运行一次），再基于缓存结果做基准对比"""
+        query_results = self.test_database_query_performance()
+        matching_results = self.test_matching_performance_with_monitoring()
+        return self.compare_with_baseline(query_results, matching_results)
+
+    def generate_optimization_report(self, comparison_results: Dict = None):
+        """
+        生成优化报告
+
+        Args:
+            comparison_results: run_all / compare_with_baseline 的结果；为空时先运行完整测试
+        """
         print("\\n=== 生成优化报告 ===")
 
-        # 运行完整测试
-        comparison_results = self.compare_with_baseline()
+        if comparison_results is None:
+            comparison_results = self.run_all()
 
         # 生成报告
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -260,8 +428,8 @@ class OptimizationComparison:
 
 | 指标 | 优化前 | 优化后 | 改进幅度 |
 |------|--------|--------|----------|
-| 平均查询时间 | {comparison_results['baseline']['query_time_ms']:.1f}ms | {comparison_results['current']['query_time_ms']:.1f}ms | {comparison_results['improvements']['query_improvement']:.1f}x |
-| 匹配成功率 | {comparison_results['baseline']['success_rate']:.1%} | {comparison_results['current']['success_rate']:.1%} | {comparison_results['improvements']['success_improvement']:.1f}x |
+| 平均查询时间(服务端) | {comparison_results['baseline'].query_time_ms:.1f}ms | {comparison_results['current'].query_time_ms:.1f}ms | {comparison_results['improvements']['query_improvement']:.1f}x |
+| 匹配成功率 | {comparison_results['baseline'].success_rate:.1%} | {comparison_results['current'].success_rate:.1%} | {comparison_results['improvements']['success_improvement']:.1f}x |
 
 ## 技术分析
 
@@ -294,20 +462,30 @@ class OptimizationComparison:
     def close(self):
         """清理资源"""
         self.data_generator.close()
+        self.db_manager.close()
 
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='负数发票匹配系统优化效果对比')
+    parser.add_argument('--report', action='store_true',
+                        help='生成 Markdown 优化报告（默认只运行对比测试，不写文件）')
+    args = parser.parse_args()
+
     print("=== 负数发票匹配系统优化效果对比 ===\\n")
 
     comparison = OptimizationComparison()
 
     try:
-        # 运行对比测试并生成报告
-        report_path = comparison.generate_optimization_report()
+        # 运行对比测试（每个子测试只运行一次）
+        comparison_results = comparison.run_all()
 
         print(f"\\n🎉 优化对比测试完成！")
-        print(f"📄 详细报告: {report_path}")
+
+        # 报告生成（字符串格式化 + 写文件）只在显式要求时进行
+        if args.report:
+            report_path = comparison.generate_optimization_report(comparison_results)
+            print(f"📄 详细报告: {report_path}")
 
     except Exception as e:
         print(f"\\n❌ 测试失败: {e}")